@@ -1,16 +1,113 @@
 # agno_a2a_tools.py
+import asyncio
+import importlib.util
+import itertools
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import uuid
-from typing import Dict, Any, List
+import logging
+from typing import Dict, Any, List, Optional, Union
 import os
 from dotenv import load_dotenv
 
-load_dotenv() # Load environment variables from .env file
+try:
+    import orjson
+except ImportError: # orjson is optional; fall back to the stdlib codec
+    orjson = None
+try:
+    import msgpack
+except ImportError: # msgpack is optional; without it the wire format is always JSON
+    msgpack = None
+
+# Load environment variables from .env file, once per process even when several modules do this
+if not os.environ.get("A2A_DOTENV_LOADED"):
+    load_dotenv()
+    os.environ["A2A_DOTENV_LOADED"] = "1"
+
+# JSON codec shims: both loaders accept raw bytes, so response bodies are parsed
+# without first being decoded to str.
+_loads = orjson.loads if orjson else json.loads
+_dumpb = orjson.dumps if orjson else (lambda obj: json.dumps(obj, separators=(",", ":")).encode())
+
+def _dumps(obj: Any) -> str:
+    return _dumpb(obj).decode()
+
+# Compressed responses are decoded transparently by httpx/urllib3; brotli is only
+# advertised when a decoder for it is installed.
+_ACCEPT_ENCODING = "gzip, deflate, br" if (
+    importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi")
+) else "gzip, deflate"
+
+log = logging.getLogger("a2a")
+log.setLevel(os.getenv("A2A_LOG_LEVEL", "WARNING").upper())
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    log.addHandler(_handler)
+
+# --- Shared HTTP Client ---
+# One pooled AsyncClient per event loop. With HTTP/2 (needs the 'h2' package) the
+# concurrent tasks/send calls to one agent are multiplexed over a single TCP/TLS
+# connection; otherwise HTTP/1.1 keep-alive sockets are pooled and reused.
+_HTTP2 = importlib.util.find_spec("h2") is not None
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_client() -> httpx.AsyncClient:
+    """Returns the shared AsyncClient, (re)creating it lazily for the running event loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            http2=_HTTP2,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=30),
+            timeout=20,
+        )
+        _client_loop = loop
+    return _client
+
+async def close_session() -> None:
+    """Closes the shared AsyncClient (call on shutdown of the owning event loop)."""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+# Blocking callers (e.g. the orchestrator's registry snapshot) share a pooled
+# requests.Session with keep-alive and retry-with-backoff on transient 5xx.
+HTTP_SESSION = requests.Session()
+_HTTP_ADAPTER = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+)
+HTTP_SESSION.mount("http://", _HTTP_ADAPTER)
+HTTP_SESSION.mount("https://", _HTTP_ADAPTER)
+HTTP_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": _ACCEPT_ENCODING})
+
+# Binary wire format (opt-in via A2A_WIRE_FORMAT=msgpack). Endpoints that answer
+# 415 Unsupported Media Type are remembered and spoken to in JSON from then on.
+_MSGPACK = "application/msgpack"
+_USE_MSGPACK = msgpack is not None and os.getenv("A2A_WIRE_FORMAT", "json").lower() == "msgpack"
+_json_only_endpoints: set = set()
+
+def _decode_response(response: httpx.Response) -> Any:
+    if response.headers.get("content-type", "").startswith(_MSGPACK):
+        return msgpack.unpackb(response.content, raw=False)
+    return _loads(response.content)
+
+# JSON-RPC request IDs only need to be unique per process, so a counter suffices
+_req_counter = itertools.count()
+# Task IDs reach other agents, so they add a per-process random prefix to the counter
+_TASK_ID_PREFIX = f"{os.urandom(6).hex()}{os.getpid():x}-"
+_task_counter = itertools.count()
 
 # --- Core A2A Client Tool ---
 
-def call_a2a_agent(target_url: str, message_parts: List[Dict[str, Any]], task_id: str = None) -> str:
+async def call_a2a_agent(target_url: str, message_parts: List[Dict[str, Any]], task_id: str = None) -> str:
     """
     Sends a synchronous A2A task request (tasks/send) to a target A2A agent/server.
 
@@ -24,15 +121,31 @@ def call_a2a_agent(target_url: str, message_parts: List[Dict[str, Any]], task_id
 
     Returns:
         str: A JSON string representation of the resulting A2A Task object, or an error string.
+
+    The payload is sent as compact JSON (or msgpack when A2A_WIRE_FORMAT=msgpack and the
+    target accepts it) and gzip/deflate (and brotli, when a decoder is
+    installed) responses are accepted; servers should enable response compression.
+    """
+    return _dumps(await _send_task(target_url, message_parts, task_id))
+
+async def _send_task(target_url: str, message_parts: List[Dict[str, Any]], task_id: str = None, metadata: Optional[Dict[str, Any]] = None,
+                     client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    """
+    Does the actual tasks/send call for call_a2a_agent and the registry tools.
+    metadata, when given, is sent as params.metadata (the registry tools use it to name the skill).
+    client overrides the shared per-loop client, e.g. for a caller that manages its own pool.
+
+    Returns:
+        Dict[str, Any]: The decoded A2A Task object, or an error object {"error": ...}.
     """
     if not target_url:
-        return json.dumps({"error": "Target URL cannot be empty."})
+        return {"error": "Target URL cannot be empty."}
     if not target_url.endswith('/'):
         target_url = target_url.rstrip('/') # Ensure no trailing slash initially
     a2a_endpoint = f"{target_url}/a2a" # Standard A2A endpoint path
 
-    current_task_id = task_id if task_id else str(uuid.uuid4())
-    request_id = str(uuid.uuid4()) # JSON-RPC request ID
+    current_task_id = task_id if task_id else f"{_TASK_ID_PREFIX}{next(_task_counter):x}"
+    request_id = f"r{next(_req_counter)}" # JSON-RPC request ID
 
     payload = {
         "jsonrpc": "2.0",
@@ -46,85 +159,137 @@ def call_a2a_agent(target_url: str, message_parts: List[Dict[str, Any]], task_id
         },
         "id": request_id
     }
+    if metadata:
+        payload["params"]["metadata"] = metadata
 
-    print(f"\n[A2A Tool] Calling {a2a_endpoint} with Task ID: {current_task_id}")
-    print(f"[A2A Tool] Payload: {json.dumps(payload, indent=2)}") # Uncomment for detailed debugging
+    log.info("[A2A Tool] Calling %s with Task ID: %s", a2a_endpoint, current_task_id)
+    log.debug("[A2A Tool] payload=%s", payload)
 
     try:
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-        response = requests.post(a2a_endpoint, headers=headers, json=payload, timeout=20) # Increased timeout
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        client = client or _get_client()
+        if _USE_MSGPACK and a2a_endpoint not in _json_only_endpoints:
+            headers = {'Content-Type': _MSGPACK, 'Accept': f'{_MSGPACK}, application/json;q=0.9', 'Accept-Encoding': _ACCEPT_ENCODING}
+            response = await client.post(a2a_endpoint, headers=headers, content=msgpack.packb(payload, use_bin_type=True))
+            if response.status_code == 415:
+                log.info("[A2A Tool] %s does not accept msgpack; falling back to JSON", a2a_endpoint)
+                _json_only_endpoints.add(a2a_endpoint)
+        if not _USE_MSGPACK or a2a_endpoint in _json_only_endpoints:
+            headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Accept-Encoding': _ACCEPT_ENCODING}
+            response = await client.post(a2a_endpoint, headers=headers, content=_dumpb(payload))
+        if response.status_code >= 400:
+            # Try to get error details from the response body
+            try:
+                error_detail = _decode_response(response)
+            except ValueError:
+                error_detail = response.content.decode(errors="replace") or f"HTTP {response.status_code} {response.reason_phrase}"
+            log.error("[A2A Tool] Error calling A2A agent at %s: HTTP %s", target_url, response.status_code)
+            return {"error": f"A2A request failed: {error_detail}"}
 
-        response_data = response.json()
-        # print(f"[A2A Tool] Response Raw: {json.dumps(response_data, indent=2)}") # Uncomment for detailed debugging
+        response_data = _decode_response(response)
+        log.debug("[A2A Tool] response=%s", response_data)
 
         # Basic validation of A2A response structure
         if "result" in response_data and isinstance(response_data["result"], dict) and "id" in response_data["result"]:
-            print(f"[A2A Tool] Received valid A2A Task Response for {current_task_id}")
-            return json.dumps(response_data["result"]) # Return the Task object as JSON string
+            log.info("[A2A Tool] Received valid A2A Task Response for %s", current_task_id)
+            return response_data["result"] # The A2A Task object
         elif "error" in response_data:
-            print(f"[A2A Tool] ERROR: A2A Error from {target_url}: {response_data['error']}")
-            return json.dumps({"error": response_data['error']}) # Propagate A2A error
+            log.error("[A2A Tool] A2A Error from %s: %s", target_url, response_data['error'])
+            return {"error": response_data['error']} # Propagate A2A error
         else:
-            print(f"[A2A Tool] ERROR: Unexpected A2A response format from {target_url}: {response_data}")
-            return json.dumps({"error": "Unexpected response format from A2A server"})
-
-    except requests.exceptions.Timeout:
-        print(f"[A2A Tool] ERROR: Timeout connecting to A2A agent at {target_url}")
-        return json.dumps({"error": f"Timeout connecting to {target_url}"})
-    except requests.exceptions.ConnectionError:
-        print(f"[A2A Tool] ERROR: Connection error connecting to A2A agent at {target_url}")
-        return json.dumps({"error": f"Could not connect to {target_url}"})
-    except requests.exceptions.RequestException as e:
-        print(f"[A2A Tool] ERROR: Error calling A2A agent at {target_url}: {e}")
-        # Try to get error details from response if available
-        error_detail = str(e)
-        if e.response is not None:
-            try:
-                error_detail = e.response.json()
-            except json.JSONDecodeError:
-                error_detail = e.response.text
-        return json.dumps({"error": f"A2A request failed: {error_detail}"})
+            log.error("[A2A Tool] Unexpected A2A response format from %s: %s", target_url, response_data)
+            return {"error": "Unexpected response format from A2A server"}
+
+    except httpx.TimeoutException:
+        log.error("[A2A Tool] Timeout connecting to A2A agent at %s", target_url)
+        return {"error": f"Timeout connecting to {target_url}"}
+    except httpx.ConnectError:
+        log.error("[A2A Tool] Connection error connecting to A2A agent at %s", target_url)
+        return {"error": f"Could not connect to {target_url}"}
+    except httpx.HTTPError as e:
+        log.error("[A2A Tool] Error calling A2A agent at %s: %s", target_url, e)
+        return {"error": f"A2A request failed: {e}"}
+    except ValueError: # json.JSONDecodeError and msgpack's unpack errors
+        log.error("[A2A Tool] Invalid JSON in response from %s", target_url)
+        return {"error": f"Invalid JSON response from {target_url}"}
     except Exception as e:
-        print(f"[A2A Tool] ERROR: Unexpected error in call_a2a_agent: {e}")
-        return json.dumps({"error": f"An unexpected error occurred: {e}"})
+        log.error("[A2A Tool] Unexpected error in call_a2a_agent: %s", e)
+        return {"error": f"An unexpected error occurred: {e}"}
+
+async def call_a2a_agents_parallel(targets: List[Dict[str, Any]]) -> str:
+    """
+    Sends several independent A2A tasks (tasks/send) concurrently, so the total wait is
+    roughly the slowest call rather than the sum of all calls.
+
+    Args:
+        targets (List[Dict[str, Any]]): One entry per call, each with keys
+                                        'target_url' (str) and 'message_parts' (list of A2A Parts).
+                                        Example: [{"target_url": "http://localhost:8001",
+                                                   "message_parts": [{"type": "text", "text": "Hello"}]}]
+
+    Returns:
+        str: A JSON list with one entry per target, in the same order: the resulting A2A Task
+             object, or an error object '{"error": ...}' for calls that failed.
+    """
+    if not targets:
+        return json.dumps({"error": "At least one target is required."})
+    log.info("[A2A Tool] Calling %d agents in parallel", len(targets))
+    results = await asyncio.gather(
+        *[call_a2a_agent(t.get("target_url", ""), t.get("message_parts", [])) for t in targets],
+        return_exceptions=True,
+    )
+    # Each successful result is already a JSON document, so splice rather than re-encode
+    return "[" + ",".join(
+        json.dumps({"error": f"An unexpected error occurred: {r}"}) if isinstance(r, BaseException) else r
+        for r in results
+    ) + "]"
 
 # --- Registration Tool ---
 
-def register_with_registry(registry_url: str, agent_card_json: str) -> str:
+async def register_with_registry(registry_url: str, agent_card: Union[Dict[str, Any], str, bytes],
+                                 client: Optional[httpx.AsyncClient] = None) -> str:
     """
     Registers this agent with the specified A2A registry by sending its Agent Card.
 
     Args:
         registry_url (str): The base URL of the A2A Agent Registry (e.g., http://localhost:8000).
-        agent_card_json (str): A JSON string representing the agent's own Agent Card.
+        agent_card (Dict[str, Any] | str | bytes): The agent's own Agent Card, either as an
+                    already-parsed dict (sent as-is) or as a JSON document (parsed once).
+        client (httpx.AsyncClient, optional): A long-lived client to send through, so retries
+                    and re-registrations reuse its connection. Defaults to the shared client.
 
     Returns:
         str: A JSON string of the resulting Task object from the registry, or an error string.
     """
-    print(f"\n[Registration Tool] Attempting registration with {registry_url}")
+    log.info("[Registration Tool] Attempting registration with %s", registry_url)
     if not registry_url:
         return json.dumps({"error": "Registry URL is required."})
     try:
-        agent_card_dict = json.loads(agent_card_json)
+        if isinstance(agent_card, dict):
+            agent_card_dict = agent_card
+        else:
+            # Cheap sanity check so obviously wrong documents fail before a full parse
+            raw = agent_card.encode() if isinstance(agent_card, str) else agent_card
+            if b'"url"' not in raw or b'"skills"' not in raw:
+                return json.dumps({"error": "Invalid Agent Card structure: 'url' and 'skills' are required."})
+            agent_card_dict = _loads(raw)
         # Basic validation of card structure
         if not isinstance(agent_card_dict, dict) or "url" not in agent_card_dict or "skills" not in agent_card_dict:
              return json.dumps({"error": "Invalid Agent Card structure: 'url' and 'skills' are required."})
 
         message_parts = [{"type": "data", "data": agent_card_dict}]
-        result = call_a2a_agent(target_url=registry_url, message_parts=message_parts)
-        print(f"[Registration Tool] Registry response: {result}")
+        result = _dumps(await _send_task(target_url=registry_url, message_parts=message_parts, metadata={"skill": "register_agent"}, client=client))
+        log.info("[Registration Tool] Registry response: %s", result)
         return result
     except json.JSONDecodeError:
-        print("[Registration Tool] ERROR: Invalid agent_card_json format.")
-        return json.dumps({"error": "Invalid agent_card_json format provided."})
+        log.error("[Registration Tool] Invalid agent_card JSON format.")
+        return json.dumps({"error": "Invalid agent_card JSON format provided."})
     except Exception as e:
-        print(f"[Registration Tool] ERROR: Failed during registration call: {e}")
+        log.error("[Registration Tool] Failed during registration call: %s", e)
         return json.dumps({"error": f"Failed to execute registration: {e}"})
 
 # --- Discovery Tool ---
 
-def discover_agents_from_registry(registry_url: str, required_skill_id: str) -> str:
+async def discover_agents_from_registry(registry_url: str, required_skill_id: str) -> str:
     """
     Discovers agents with a specific skill ID from the A2A registry.
 
@@ -138,7 +303,7 @@ def discover_agents_from_registry(registry_url: str, required_skill_id: str) ->
             Returns a JSON error object string '{"error": ...}' on failure.
             Example successful return: '[{"name": "Agent1",...}, {"name": "Agent2",...}]'
     """
-    print(f"\n[Discovery Tool] Attempting discovery for skill '{required_skill_id}' from {registry_url}")
+    log.info("[Discovery Tool] Attempting discovery for skill '%s' from %s", required_skill_id, registry_url)
     if not registry_url:
         return json.dumps({"error": "Registry URL is required."})
     if not required_skill_id:
@@ -146,37 +311,85 @@ def discover_agents_from_registry(registry_url: str, required_skill_id: str) ->
     try:
         # Send skill ID in a DataPart for structured query
         message_parts = [{"type": "data", "data": {"skill_id": required_skill_id}}]
-        task_response_json = call_a2a_agent(target_url=registry_url, message_parts=message_parts)
-
-        # Parse the Task response from the registry
-        task_response = json.loads(task_response_json)
+        # Use the decoded Task directly rather than a JSON string that would be parsed again
+        task_response = await _send_task(target_url=registry_url, message_parts=message_parts, metadata={"skill": "discover_agents"})
 
-        # Check if the call itself resulted in an error reported by call_a2a_agent
+        # Check if the call itself resulted in an error reported by _send_task
         if "error" in task_response:
-            print(f"[Discovery Tool] ERROR: Call to registry failed: {task_response['error']}")
-            return task_response_json # Propagate the error JSON
+            log.error("[Discovery Tool] Call to registry failed: %s", task_response['error'])
+            return _dumps(task_response) # Propagate the error JSON
 
         # Check the status of the A2A Task returned by the registry
         task_status = task_response.get("status", {}).get("state")
         if task_status != "completed":
-            error_msg = task_response.get("status", {}).get("message", {}).get("parts", [{}])[0].get("text", "Registry task did not complete successfully.")
-            print(f"[Discovery Tool] ERROR: Registry task status: {task_status}. Message: {error_msg}")
+            try:
+                error_msg = task_response["status"]["message"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError):
+                error_msg = "Registry task did not complete successfully."
+            log.error("[Discovery Tool] Registry task status: %s. Message: %s", task_status, error_msg)
+            return json.dumps({"error": f"Registry task failed: {error_msg}", "status": task_status})
+
+        # Extract Agent Cards (the 'data' of each 'data' artifact) in a single pass
+        discovered_cards = [
+            artifact["data"] for artifact in task_response.get("artifacts", [])
+            if artifact.get("type") == "data" and isinstance(artifact.get("data"), dict)
+        ]
+
+        log.info("[Discovery Tool] Discovery result: Found %d agents.", len(discovered_cards))
+        return _dumps(discovered_cards) # Return list of cards as JSON string
+
+    except Exception as e:
+        log.error("[Discovery Tool] Unexpected error during discovery: %s", e)
+        return json.dumps({"error": f"Unexpected error occurred during agent discovery: {e}"})
+
+
+async def discover_agents_batch(registry_url: str, skill_ids: List[str]) -> str:
+    """
+    Discovers agents for several skill IDs with a single call to the A2A registry.
+
+    Args:
+        registry_url (str): The base URL of the A2A Agent Registry (e.g., http://localhost:8000).
+        skill_ids (List[str]): The skill IDs needed by the workflow (e.g., ['web_search', 'summarize']).
+
+    Returns:
+       str: A JSON object mapping EVERY requested skill ID to its LIST of matching Agent Card
+            dictionaries (an empty list if none were found).
+            Returns a JSON error object string '{"error": ...}' on failure.
+            Example successful return: '{"web_search": [{"name": "Agent1",...}], "summarize": []}'
+    """
+    log.info("[Discovery Tool] Attempting batch discovery for skills %s from %s", skill_ids, registry_url)
+    if not registry_url:
+        return json.dumps({"error": "Registry URL is required."})
+    if not skill_ids or not isinstance(skill_ids, list):
+         return json.dumps({"error": "skill_ids must be a non-empty list of skill IDs."})
+    try:
+        message_parts = [{"type": "data", "data": {"skill_ids": skill_ids}}]
+        task_response = await _send_task(target_url=registry_url, message_parts=message_parts, metadata={"skill": "discover_agents"})
+
+        if "error" in task_response:
+            log.error("[Discovery Tool] Call to registry failed: %s", task_response['error'])
+            return _dumps(task_response)
+
+        task_status = task_response.get("status", {}).get("state")
+        if task_status != "completed":
+            try:
+                error_msg = task_response["status"]["message"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError):
+                error_msg = "Registry task did not complete successfully."
+            log.error("[Discovery Tool] Registry task status: %s. Message: %s", task_status, error_msg)
             return json.dumps({"error": f"Registry task failed: {error_msg}", "status": task_status})
 
-        # Extract Agent Cards from artifacts if task completed successfully
-        artifacts = task_response.get("artifacts", [])
-        discovered_cards = []
-        for artifact in artifacts:
-            # Expecting artifacts of type 'data' containing the agent card in the 'data' field
+        # Group the cards by the skill each artifact was matched on
+        discovered: Dict[str, List[Dict[str, Any]]] = {skill_id: [] for skill_id in skill_ids}
+        for artifact in task_response.get("artifacts", []):
             if artifact.get("type") == "data" and isinstance(artifact.get("data"), dict):
-                discovered_cards.append(artifact["data"]) # Append the agent card dictionary
+                skill_id = (artifact.get("metadata") or {}).get("skill_id")
+                if skill_id in discovered:
+                    discovered[skill_id].append(artifact["data"])
 
-        print(f"[Discovery Tool] Discovery result: Found {len(discovered_cards)} agents.")
-        return json.dumps(discovered_cards) # Return list of cards as JSON string
+        log.info("[Discovery Tool] Batch discovery result: %s", {k: len(v) for k, v in discovered.items()})
+        return _dumps(discovered)
 
-    except json.JSONDecodeError:
-        print(f"[Discovery Tool] ERROR: Failed to parse registry response JSON: {task_response_json}")
-        return json.dumps({"error": "Failed to parse JSON response from registry."})
     except Exception as e:
-        print(f"[Discovery Tool] ERROR: Unexpected error during discovery: {e}")
-        return json.dumps({"error": f"Unexpected error occurred during agent discovery: {e}"})
\ No newline at end of file
+        log.error("[Discovery Tool] Unexpected error during batch discovery: %s", e)
+        return json.dumps({"error": f"Unexpected error occurred during agent discovery: {e}"})
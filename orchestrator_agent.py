@@ -1,58 +1,130 @@
 # orchestrator_agent.py
-import os, sys, json, requests
-from typing import List, Dict, Any, Optional
+import os, sys, json, time, asyncio, logging, requests
+import ijson
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
 
 from dotenv import load_dotenv
 
-# --- Agno imports -----------------------------------------------------------
-from agno.agent import Agent, RunResponse
-from agno.models.groq import Groq
-
 # --- Local tool imports ------------------------------------------------------
 try:
-    from agno_a2a_tools import call_a2a_agent, discover_agents_from_registry
+    from agno_a2a_tools import (
+        call_a2a_agent, call_a2a_agents_parallel, discover_agents_from_registry, discover_agents_batch,
+        close_session, HTTP_SESSION,
+    )
     print("[Orchestrator] Tools imported from agno_a2a_tools.py")
 except Exception as err:
     sys.exit(f"[Orchestrator] FATAL: cannot import A2A tools → {err}")
 
+log = logging.getLogger("a2a")
+
 # --- Environment -------------------------------------------------------------
-load_dotenv()
+if not os.environ.get("A2A_DOTENV_LOADED"): # agno_a2a_tools usually got there first
+    load_dotenv()
+    os.environ["A2A_DOTENV_LOADED"] = "1"
 REGISTRY_URL = os.getenv("A2A_REGISTRY_URL")
 GROQ_API_KEY  = os.getenv("GROQ_API_KEY")
+# Agno's tool-call and debug output is printed on every run; opt in with AGNO_DEBUG=1
+AGNO_DEBUG = os.getenv("AGNO_DEBUG", "").lower() in ("1", "true", "yes")
 
 if not REGISTRY_URL or not GROQ_API_KEY:
     sys.exit("FATAL: A2A_REGISTRY_URL or GROQ_API_KEY missing in environment.")
 
+# Registry snapshots are cached for a short TTL; once stale they are revalidated
+# with a conditional GET so an unchanged registry answers 304 with no body.
+REGISTRY_CONTEXT_TTL = float(os.getenv("A2A_REGISTRY_TTL", 30))
+# registry url -> (expiry, etag, last_modified, (url, card) pairs, rendered_context)
+_ctx_cache: Dict[str, Tuple[float, str, str, List[Tuple[str, Dict[str, Any]]], str]] = {}
+
 # --------------------------------------------------------------------------- #
 #                               Helper functions                              #
 # --------------------------------------------------------------------------- #
+def _parse_registry_snapshot(stream) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    (url, Agent Card) for each card in a streamed /agents body. Cards are built one
+    at a time as the body arrives, so the whole response is never held as one document.
+    """
+    return list(ijson.kvitems(stream, "registered_agents", use_float=True))
+
+def _card_skill_ids(card: Dict[str, Any]) -> List[str]:
+    return [str(skill.get("id", "no_id")) for skill in card.get("skills") or [] if isinstance(skill, dict)]
+
 def get_registry_context(registry_base_url: str) -> str:
-    """Fetch a snapshot of the registry for prompt‑context."""
+    """Fetch a snapshot of the registry for prompt‑context (cached for A2A_REGISTRY_TTL seconds)."""
     header = "== Current Registered Agents Context (fetched at startup) ==\n"
     footer = "== End of Context ==\n"
     if not registry_base_url:
         return header + "Error: registry URL not configured.\n" + footer
 
+    now = time.monotonic()
+    cached = _ctx_cache.get(registry_base_url)
+    if cached and cached[0] > now:
+        return cached[4]
+
     agents_ep = f"{registry_base_url.rstrip('/')}/agents"
     try:
-        print(f"[Context] GET {agents_ep}")
-        resp = requests.get(agents_ep, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        body = ""
-        for url, card in data.get("registered_agents", {}).items():
-            name   = card.get("name", "Unnamed Agent")
-            skills = ", ".join(
-                s.get("id", "no_id") for s in card.get("skills", []) if isinstance(s, dict)
-            ) or "None"
-            body += f"  - Name: {name}, URL: {url}, Skill IDs: {skills}\n"
-        return header + body + footer
-    except (requests.RequestException, json.JSONDecodeError) as e:
+        headers = {}
+        if cached:
+            if cached[1]:
+                headers["If-None-Match"] = cached[1]
+            if cached[2]:
+                headers["If-Modified-Since"] = cached[2]
+        log.info("[Context] GET %s", agents_ep)
+        with HTTP_SESSION.get(agents_ep, headers=headers, timeout=5, stream=True) as resp:
+            if resp.status_code == 304 and cached:
+                _ctx_cache[registry_base_url] = (now + REGISTRY_CONTEXT_TTL, *cached[1:])
+                return cached[4]
+            resp.raise_for_status()
+            resp.raw.decode_content = True # Let urllib3 undo any Content-Encoding while streaming
+            agents = _parse_registry_snapshot(resp.raw)
+            etag = resp.headers.get("ETag", "")
+            last_modified = resp.headers.get("Last-Modified", "")
+        lines = [
+            f"  - Name: {card.get('name') or 'Unnamed Agent'}, URL: {url}, Skill IDs: {', '.join(_card_skill_ids(card)) or 'None'}\n"
+            for url, card in agents
+        ]
+        context = "".join([header, *lines, footer]) # One allocation instead of a copy per agent
+        _ctx_cache[registry_base_url] = (now + REGISTRY_CONTEXT_TTL, etag, last_modified, agents, context)
+        return context
+    except (requests.RequestException, json.JSONDecodeError, ijson.JSONError) as e:
+        log.error("[Context] Error fetching registry: %s", e)
         return header + f"- Error fetching registry: {e}\n" + footer
 
+def get_registry_agents(registry_base_url: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """(url, Agent Card) for every registered agent, from the same cached snapshot as the context."""
+    get_registry_context(registry_base_url)
+    cached = _ctx_cache.get(registry_base_url)
+    return cached[3] if cached else []
+
 # --------------------------------------------------------------------------- #
 #                               Orchestrator                                  #
 # --------------------------------------------------------------------------- #
+# Static part of the prompt, joined once at import; only the registry context varies.
+_STATIC_INSTRUCTIONS = "\n".join([
+    "Your goal is to satisfy the user by orchestrating specialised agents.",
+    "Steps:",
+    "1. Decide which skill‑id is required (e.g. 'web_search').",
+    "   If the workflow needs SEVERAL skill‑ids, resolve them together: call lookup_skill for each, "
+    "   and for any that return '[]' call discover_agents_batch(registry_url, skill_ids) ONCE "
+    "   instead of discover_agents_from_registry per skill.",
+    "2. If the skill‑id is NOT in the registry‑context, reply with "
+    "   'Error: No agent with skill ID \"<skill_id>\" listed in context.'",
+    "3. Otherwise call lookup_skill(skill_id). Only if that returns exactly '[]', "
+    "   call discover_agents_from_registry(registry_url, skill_id).",
+    "4. If discovery also returns exactly '[]', reply with "
+    "   'Error: Discovery failed for skill ID \"<skill_id>\".'",
+    "5. Parse the JSON; take the FIRST agent card, extract its 'url'.",
+    "6. Build message_parts **as a Python list of dicts**, e.g. "
+    "   `[{'type':'text','text':'<user‑query>'}]`.",
+    "7. Call call_a2a_agent(target_url, message_parts).",
+    "   If several discovered cards are viable, or the request splits into independent "
+    "   sub-queries, call call_a2a_agents_parallel(targets) ONCE instead, with "
+    "   targets = [{'target_url': '<url>', 'message_parts': [...]}, ...].",
+    "8. Parse the returned JSON task; if status.state == 'completed' "
+    "   present the answer (usually in artifacts). Otherwise report the failure.",
+    "Only the tools provided above may be used.",
+])
+
 class OrchestratorAgent:
     def __init__(self, registry_url: str):
         if not registry_url:
@@ -60,46 +132,64 @@ class OrchestratorAgent:
 
         print(f"[Orchestrator] Initialising (registry={registry_url})")
 
-        # Prompt‑context & instructions ---------------------------------------
+        self.registry_url = registry_url
+
+        # Prompt‑context (TTL-cached per registry) & instructions -------------
         context = get_registry_context(registry_url)
-        instructions = [
-            "Your goal is to satisfy the user by orchestrating specialised agents.",
-            "Steps:",
-            "1. Decide which skill‑id is required (e.g. 'web_search').",
-            "2. If the skill‑id is NOT in the registry‑context, reply with "
-            "   'Error: No agent with skill ID \"<skill_id>\" listed in context.'",
-            "3. Otherwise call discover_agents_from_registry(registry_url, skill_id).",
-            "4. If it returns exactly '[]', reply with "
-            "   'Error: Discovery failed for skill ID \"<skill_id>\".'",
-            "5. Parse the JSON; take the FIRST agent card, extract its 'url'.",
-            "6. Build message_parts **as a Python list of dicts**, e.g. "
-            "   `[{'type':'text','text':'<user‑query>'}]`.",
-            "7. Call call_a2a_agent(target_url, message_parts).",
-            "8. Parse the returned JSON task; if status.state == 'completed' "
-            "   present the answer (usually in artifacts). Otherwise report the failure.",
-            "Only the two tools provided above may be used.",
-        ]
-        full_instructions = context + "\n---\n" + "\n".join(instructions)
+        self.refresh_skill_index()
+        full_instructions = f"{context}\n---\n{_STATIC_INSTRUCTIONS}"
 
-        # Agent with BOTH tools ----------------------------------------------
+        # Agent with the discovery + A2A call tools ---------------------------
+        # agno/Groq are imported here rather than at module level: they are slow to
+        # import and not needed by callers that never build an agent.
+        from agno.agent import Agent
+        from agno.models.groq import Groq
         self.agent = Agent(
             model=Groq(id="meta-llama/llama-4-scout-17b-16e-instruct"),
             description="Research Orchestrator Agent",
             instructions=full_instructions,
-            tools=[discover_agents_from_registry, call_a2a_agent],
-            show_tool_calls=True,
-            debug_mode=True,
+            tools=[
+                self.lookup_skill, discover_agents_from_registry, discover_agents_batch,
+                call_a2a_agent, call_a2a_agents_parallel,
+            ],
+            show_tool_calls=AGNO_DEBUG,
+            debug_mode=AGNO_DEBUG,
         )
         print("[Orchestrator] Agent ready.")
 
     # -----------------------------------------------------------------------
-    def run_task(self, user_query: str) -> str:
+    def refresh_skill_index(self) -> None:
+        """Rebuilds the skill id -> agent cards index from the (cached) registry snapshot."""
+        skill_index: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for url, card in get_registry_agents(self.registry_url):
+            for skill_id in dict.fromkeys(_card_skill_ids(card)):
+                skill_index[skill_id].append(card)
+        # Swap in one assignment so lookups never see a half-built index
+        self._skill_index = skill_index
+
+    def lookup_skill(self, skill_id: str) -> str:
+        """
+        Looks up agents with a skill ID in the locally cached registry snapshot (no HTTP call).
+
+        Args:
+            skill_id (str): The ID of the skill the desired agent must possess (e.g., 'web_search').
+
+        Returns:
+            str: A JSON list of the full matching Agent Cards, as the registry stores them,
+                 or '[]' if the snapshot has none; use discover_agents_from_registry in that case.
+        """
+        return json.dumps(self._skill_index.get(skill_id, []))
+
+    # -----------------------------------------------------------------------
+    async def run_task_async(self, user_query: str) -> str:
         if not user_query.strip():
             return "Error: user query cannot be empty."
 
+        from agno.agent import RunResponse # Already loaded by __init__, so this is a dict lookup
+
         print(f"[Orchestrator] ⇢ {user_query}")
         try:
-            resp = self.agent.run(user_query)
+            resp = await self.agent.arun(user_query)
             if isinstance(resp, RunResponse):
                 content = resp.content
             else:                       # safety‑net for raw strings etc.
@@ -110,25 +200,57 @@ class OrchestratorAgent:
             print(f"[Orchestrator] ERROR: {e}")
             return f"Error during task execution: {e}"
 
+    def run_task(self, user_query: str) -> str:
+        """Blocking wrapper around run_task_async for callers without an event loop."""
+        async def _run() -> str:
+            try:
+                return await self.run_task_async(user_query)
+            finally:
+                await close_session() # The pooled HTTP session lives as long as this loop
+        return asyncio.run(_run())
+
 # --------------------------------------------------------------------------- #
 #                               CLI loop                                      #
 # --------------------------------------------------------------------------- #
-def main() -> None:
+async def _background_warm_registry(orch: OrchestratorAgent) -> None:
+    """Refreshes the registry snapshot (and its pooled connection) while waiting on the user."""
+    try:
+        await asyncio.to_thread(orch.refresh_skill_index)
+    except Exception as e:
+        log.warning("[Context] Background registry refresh failed: %s", e)
+
+async def main_async() -> None:
     orch = OrchestratorAgent(REGISTRY_URL)
+    try:
+        from prompt_toolkit import PromptSession
+        session = PromptSession()
+        prompt = lambda: session.prompt_async("You: ")
+    except ImportError:                 # plain stdin, read off the event loop
+        prompt = lambda: asyncio.to_thread(input, "You: ")
+
     print("\nType 'quit' to exit.")
+    warm_task: Optional[asyncio.Task] = None
     try:
         while True:
+            if warm_task is None or warm_task.done():
+                warm_task = asyncio.create_task(_background_warm_registry(orch))
             try:
-                user_in = input("You: ").strip()
+                user_in = (await prompt()).strip()
                 if user_in.lower() in {"quit", "exit"}:
                     break
                 if not user_in:
                     continue
-                print("Orchestrator:", orch.run_task(user_in), "\n" + "-" * 20)
+                print("Orchestrator:", await orch.run_task_async(user_in), "\n" + "-" * 20)
             except (EOFError, KeyboardInterrupt):
                 break
     finally:
+        if warm_task is not None:
+            warm_task.cancel()
+        await close_session()
         print("\n[Orchestrator] Bye.")
 
+def main() -> None:
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     main()
@@ -1,23 +1,95 @@
 # registry_server.py
 import uvicorn
+import asyncio
+import heapq
 from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, ValidationError
-from typing import Dict, List, Any, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Dict, List, Any, NotRequired, Optional, Set, Tuple, TypedDict, Union
+from collections import OrderedDict
 import json
-import uuid
+import contextvars
 import datetime
 import time
 import os
+import logging
+import logging.handlers
+import queue
+import atexit
+import importlib.util
+import itertools
+import msgspec
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError: # orjson is optional; stdlib json is used without it
+    orjson = None
+try:
+    import msgpack
+except ImportError: # msgpack is optional; without it only JSON is spoken
+    msgpack = None
+try:
+    import redis.asyncio as aioredis
+except ImportError: # redis is optional; without it the registry lives in process memory
+    aioredis = None
+
 load_dotenv()
 
+# Records go onto a bounded queue and a listener thread does the stream writes, so a
+# handler never waits on stderr. Under a flood past the bound, records are dropped.
+LOG_QUEUE_SIZE = 10000
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def attach_queued_handler(logger: logging.Logger) -> None:
+    """Gives the logger a non-blocking handler writing "LEVEL message" lines to stderr."""
+    if logger.handlers:
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes whatever is still queued at exit
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+
+# Messages use lazy %-style arguments, so those below A2A_LOG_LEVEL cost only a level check
+log = logging.getLogger("registry")
+log.setLevel(os.getenv("A2A_LOG_LEVEL", "WARNING").upper())
+attach_queued_handler(log)
+
 # --- Simple In-Memory Storage with TTL ---
 # In production, replace this with a database (e.g., PostgreSQL, Redis)
 registered_agents: Dict[str, Dict[str, Any]] = {}
+# Each card pre-serialized as its '"url":{...}' member, so /agents is a byte splice
+registered_agents_bytes: Dict[str, bytes] = {}
+# Bumped whenever registered_agents_bytes changes; the /agents ETag is derived from it
+_agents_version = 0
+# Single-skill discovery results, pre-serialized: skill ID -> (artifacts JSON, match count).
+# Only skills some agent lists are cached, as an LRU of at most DISCOVERY_CACHE_SIZE
+# entries, so made-up skill IDs can't grow it. Cleared whenever an agent is registered
+# or pruned.
+DISCOVERY_CACHE_SIZE = int(os.getenv("A2A_DISCOVERY_CACHE_SIZE", 1024))
+_disco_cache: "OrderedDict[str, Tuple[bytes, int]]" = OrderedDict()
 agent_last_seen: Dict[str, float] = {}
+# Inverted index (skill ID -> agent URLs) kept in step with registered_agents so
+# discovery is a dict lookup rather than a scan over every card and skill. The inner
+# dicts are used as ordered sets, so discovery lists agents in registration order.
+skill_index: Dict[str, Dict[str, None]] = {}
 AGENT_TTL_SECONDS = 300 # Agent entry expires after 5 minutes of inactivity
+# Set A2A_REDIS_URL (e.g. redis://localhost:6379/0) to keep registrations in Redis instead,
+# so several registry processes/hosts share one registry and Redis TTLs do the pruning.
+REDIS_URL = os.getenv("A2A_REDIS_URL")
+# Min-heap of (expiry time, agent URL), pushed on every registration. Re-registering
+# leaves the older entry in place; pruning skips it by checking agent_last_seen.
+expiry_heap: List[Tuple[float, str]] = []
 
 # --- Pydantic Models for Basic Validation ---
 # Based loosely on A2A Spec - real validation would be more thorough
@@ -45,33 +117,64 @@ class AgentCardModel(BaseModel):
     skills: List[A2ASkill] = []
     # Add other fields like defaultInputModes, defaultOutputModes if needed
 
-class A2APart(BaseModel):
+# Built once so the core schema is compiled at import rather than on the request path
+_AGENT_CARD_TA = TypeAdapter(AgentCardModel)
+
+# --- msgspec Structs for the JSON-RPC Envelope ---
+# The envelope is decoded and type-checked in one pass straight from the request body;
+# only Agent Cards go through Pydantic. Defaults keep the handler as lenient as before
+# about a missing task or message.
+class A2APart(msgspec.Struct):
     type: Optional[str] = 'text' # 'text', 'data', 'file'
     text: Optional[str] = None
-    data: Optional[Any] = None # Could be dict, list, etc.
+    data: Any = None # Could be dict, list, etc.
     # file fields omitted for simplicity
 
-class A2AMessage(BaseModel):
-    role: str # 'user', 'agent'
-    parts: List[A2APart]
+class A2AMessage(msgspec.Struct):
+    role: str = "user" # 'user', 'agent'
+    parts: List[A2APart] = []
 
-class A2ATask(BaseModel):
-    id: str
+class A2ATask(msgspec.Struct):
+    id: Optional[str] = None
 
-class A2AParams(BaseModel):
-    task: A2ATask
-    message: A2AMessage
+class A2AParams(msgspec.Struct):
+    task: A2ATask = msgspec.field(default_factory=A2ATask)
+    message: A2AMessage = msgspec.field(default_factory=A2AMessage)
+    metadata: Dict[str, Any] = {} # May name the registry skill to invoke: {"skill": "discover_agents"}
 
-class A2ARequest(BaseModel):
-    jsonrpc: str = "2.0"
+class A2ARequest(msgspec.Struct):
+    jsonrpc: str
     method: str
     params: A2AParams
-    id: str # JSON-RPC request ID
+    id: Optional[Union[str, int]] = None # JSON-RPC request ID; null (or absent) is echoed back as null
+
+_DATA_PART_TYPE = "data"
+# Keys whose presence marks a DataPart as an Agent Card when no skill is named
+_REG_KEYS = frozenset(("url", "skills", "name"))
+# Skills a caller may name in params.metadata.skill to skip the DataPart heuristics
+_REGISTRY_SKILLS = frozenset(("register_agent", "discover_agents"))
+
+_REQ_JSON_DECODER = msgspec.json.Decoder(A2ARequest)
+_REQ_MSGPACK_DECODER = msgspec.msgpack.Decoder(A2ARequest)
+
+class _IdOnly(msgspec.Struct):
+    id: Optional[Union[str, int]] = None
+
+_ID_JSON_DECODER = msgspec.json.Decoder(_IdOnly)
+_ID_MSGPACK_DECODER = msgspec.msgpack.Decoder(_IdOnly)
+
+def request_id_of(body: bytes, is_msgpack: bool = False) -> Optional[Union[str, int]]:
+    """Recovers the JSON-RPC id from an envelope that failed validation, or None if it has none."""
+    try:
+        return (_ID_MSGPACK_DECODER if is_msgpack else _ID_JSON_DECODER).decode(body).id
+    except msgspec.MsgspecError:
+        return None
 
 # --- Registry Configuration ---
 REGISTRY_HOST = "0.0.0.0"
 REGISTRY_PORT = int(os.getenv("REGISTRY_PORT", 8000))
 REGISTRY_URL = os.getenv("A2A_REGISTRY_URL", f"http://localhost:{REGISTRY_PORT}")
+REGISTRY_WORKERS = int(os.getenv("REGISTRY_WORKERS", 1))
 
 # --- Registry's Own Agent Card ---
 REGISTRY_AGENT_CARD = {
@@ -92,203 +195,531 @@ REGISTRY_AGENT_CARD = {
    {
      "id": "discover_agents",
      "name": "Discover Agents",
-     "description": "Discovers agents based on skill ID provided in a DataPart {'skill_id': '...'}.",
+     "description": "Discovers agents based on skill ID provided in a DataPart {'skill_id': '...'}, or several at once via {'skill_ids': [...]}.",
      "inputModes": ["application/json"], # Expects query criteria in DataPart
      "outputModes": ["application/json"] # Returns list of Agent Cards as DataPart artifacts
    }
  ]
 }
 
+# --- JSON Codec ---
+# Request bodies are parsed straight from bytes and responses rendered in one pass with
+# orjson when it is installed. orjson.JSONDecodeError subclasses json.JSONDecodeError,
+# so the existing parse-error handling covers both.
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+class FastResponse(Response):
+    """A JSON response whose content is already-serialized bytes, passed through untouched."""
+    media_type = "application/json"
+
+    def render(self, content: bytes) -> bytes:
+        return content
+
+def _dumpb(obj: Any) -> bytes:
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj, separators=(",", ":")).encode()
+
+# The registry's own card never changes, so it is serialized once for every request
+_REGISTRY_CARD_BYTES = _dumpb(REGISTRY_AGENT_CARD)
+
+def _loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+async def read_json_body(request: Request) -> Any:
+    """Parses the request body as JSON without going through Starlette's stdlib decoder."""
+    return _loads(await request.body())
+
+# --- Wire Format ---
+# Clients may send tasks as application/msgpack and ask for msgpack replies via Accept.
+# The format negotiated for the current request is kept in a context variable so the
+# JSON-RPC helpers below encode their response to match.
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_response_format: contextvars.ContextVar[str] = contextvars.ContextVar("response_format", default="json")
+
+def _render_jsonrpc(content: Dict[str, Any], status_code: int = 200) -> Response:
+    if _response_format.get() == "msgpack":
+        return Response(content=msgpack.packb(content, use_bin_type=True), status_code=status_code, media_type=MSGPACK_MEDIA_TYPE)
+    body = _dumpb(content)
+    return FastResponse(content=body, status_code=status_code, headers={"content-length": str(len(body))})
+
+def serve(app: FastAPI, import_path: str, host: str, port: int, processes: int) -> None:
+    """Runs an A2A app under uvicorn with uvloop/httptools when installed and no access log."""
+    uvicorn.run(
+        # Spawned processes can't be handed the app object; each imports it from import_path
+        import_path if processes > 1 else app,
+        host=host,
+        port=port,
+        workers=processes,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        access_log=False, # Per-request access logging stays off the hot path
+        log_level="warning",
+    )
+
 # --- FastAPI App ---
-app = FastAPI(title="A2A Agent Registry")
+app = FastAPI(title="A2A Agent Registry", default_response_class=ORJSONResponse)
+# Registrations and discovery results carry whole Agent Cards; compress larger bodies
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # --- Helper Functions ---
-def create_a2a_task_response(task_id: str, status: str, artifacts: List[Dict[str, Any]] = None, message_text: str = None) -> Dict[str, Any]:
+# Generated task IDs are a per-process random prefix plus a counter: unique across
+# processes and restarts without a urandom read per task. They aren't secrets.
+_TASK_ID_PREFIX = f"{os.urandom(6).hex()}{os.getpid():x}-"
+_task_id_counter = itertools.count()
+
+def new_task_id() -> str:
+    return f"{_TASK_ID_PREFIX}{next(_task_id_counter):x}"
+
+# Task timestamps are reused for 100ms: formatting a tz-aware datetime per reply is pure
+# overhead when bursts of replies go out within the same tick.
+_ts_cache = [0, ""] # [tick (time * 10), ISO-8601 string]
+_UTC = datetime.timezone.utc
+_fromtimestamp = datetime.datetime.fromtimestamp
+
+def _utcnow_iso() -> str:
+    t = time.time()
+    tick = int(t * 10)
+    if tick != _ts_cache[0]:
+        _ts_cache[0] = tick
+        _ts_cache[1] = _fromtimestamp(t, _UTC).isoformat()
+    return _ts_cache[1]
+
+# Shape of the Task in a tasks/send reply. These are plain dicts at runtime, built as
+# literals; the TypedDicts only document and type-check the keys.
+class A2ATaskStatus(TypedDict):
+    state: str
+    timestamp: str
+    message: NotRequired[Dict[str, Any]]
+
+class A2ATaskResult(TypedDict):
+    id: str
+    status: A2ATaskStatus
+    artifacts: List[Dict[str, Any]]
+    history: List[Dict[str, Any]]
+    metadata: Dict[str, Any]
+
+def create_a2a_task_response(task_id: str, status: str, artifacts: List[Dict[str, Any]] = None, message_text: str = None) -> A2ATaskResult:
     """Creates a basic A2A Task response structure."""
-    response_task = {
-        "id": task_id,
-        "status": {
+    task_status: A2ATaskStatus
+    if message_text:
+        # Ensure message is structured correctly according to A2A spec
+        task_status = {
             "state": status,
-            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()
-        },
+            "timestamp": _utcnow_iso(),
+            "message": {"role": "agent", "parts": [{"type": "text", "text": message_text}]},
+        }
+    else:
+        task_status = {"state": status, "timestamp": _utcnow_iso()}
+    return {
+        "id": task_id,
+        "status": task_status,
         "artifacts": artifacts if artifacts is not None else [],
         "history": [], # Keep history simple for this example
-        "metadata": {}
+        "metadata": {},
     }
-    if message_text:
-        # Ensure message is structured correctly according to A2A spec
-        response_task["status"]["message"] = {
-            "role": "agent",
-            "parts": [{"type": "text", "text": message_text}]
-        }
-    return response_task
 
 def prune_expired_agents():
     """Removes agents that haven't checked in within the TTL."""
+    global _agents_version
     now = time.time()
-    expired_urls = [url for url, last_seen in agent_last_seen.items() if now - last_seen > AGENT_TTL_SECONDS]
+    expired_urls = []
+    # Only the front of the heap can have expired; nothing to do when it has not
+    while expiry_heap and expiry_heap[0][0] <= now:
+        _, url = heapq.heappop(expiry_heap)
+        last_seen = agent_last_seen.get(url)
+        if last_seen is not None and last_seen + AGENT_TTL_SECONDS <= now:
+            expired_urls.append(url)
     if expired_urls:
-        print(f"\n[Registry] Pruning {len(expired_urls)} expired agents.")
+        log.info("[Registry] Pruning %s expired agents.", len(expired_urls))
+        _disco_cache.clear()
         for url in expired_urls:
             if url in registered_agents:
-                del registered_agents[url]
+                unindex_agent(url, registered_agents.pop(url))
+                registered_agents_bytes.pop(url, None)
+                _agents_version += 1
             if url in agent_last_seen:
                 del agent_last_seen[url]
-            print(f"[Registry] Pruned agent: {url}")
-
-def create_jsonrpc_response(result: Any, request_id: str) -> JSONResponse:
-    return JSONResponse(content={"jsonrpc": "2.0", "result": result, "id": request_id})
-
-def create_jsonrpc_error(code: int, message: str, request_id: Optional[str], status_code: int = 400) -> JSONResponse:
+            log.info("[Registry] Pruned agent: %s", url)
+
+def _card_skill_ids(card_dict: Dict[str, Any]) -> Set[str]:
+    return {skill["id"] for skill in card_dict.get("skills", []) if isinstance(skill, dict) and "id" in skill}
+
+def index_agent(agent_url: str, card_dict: Dict[str, Any], old_card: Optional[Dict[str, Any]] = None) -> None:
+    """Points skill_index at agent_url for each skill in its card, dropping skills the old card had."""
+    new_skills = _card_skill_ids(card_dict)
+    if old_card is not None:
+        for skill_id in _card_skill_ids(old_card) - new_skills:
+            _discard_from_index(skill_id, agent_url)
+    for skill_id in new_skills:
+        skill_index.setdefault(skill_id, {})[agent_url] = None
+
+def unindex_agent(agent_url: str, card_dict: Dict[str, Any]) -> None:
+    """Removes agent_url from skill_index for every skill in its card."""
+    for skill_id in _card_skill_ids(card_dict):
+        _discard_from_index(skill_id, agent_url)
+
+def _discard_from_index(skill_id: str, agent_url: str) -> None:
+    urls = skill_index.get(skill_id)
+    if urls is not None:
+        urls.pop(agent_url, None)
+        if not urls:
+            del skill_index[skill_id] # Keep the index from accumulating empty entries
+
+def find_agents_with_skill(skill_id: str) -> List[Dict[str, Any]]:
+    """Returns the stored Agent Cards that list the given skill ID."""
+    return [registered_agents[url] for url in skill_index.get(skill_id, ())]
+
+def create_jsonrpc_response(result: Any, request_id: Optional[Union[str, int]]) -> Response:
+    return _render_jsonrpc({"jsonrpc": "2.0", "result": result, "id": request_id})
+
+def create_jsonrpc_error(code: int, message: str, request_id: Optional[Union[str, int]], status_code: int = 400) -> Response:
     error_obj = {
         "jsonrpc": "2.0",
         "error": {"code": code, "message": message},
         "id": request_id
     }
-    return JSONResponse(content=error_obj, status_code=status_code)
+    return _render_jsonrpc(error_obj, status_code=status_code)
+
+
+# --- Storage Backend ---
+# Registrations go to the in-memory dicts above, or to Redis when A2A_REDIS_URL is set:
+#   a2a:agent:<url>    serialized Agent Card, expiring after AGENT_TTL_SECONDS
+#   a2a:skill:<id>     set of agent URLs listing the skill
+#   a2a:agents         set of all registered agent URLs
+#   a2a:agents:expiry  sorted set of agent URL -> expiry time, so expiries are noticed without a read
+#   a2a:agents:version counter bumped whenever the /agents document changes; its ETag
+# The sets are refreshed on every registration and can outlive a card, so members whose
+# card has expired (or no longer lists the skill) are skipped and removed on read.
+redis_client = None # Set at startup when Redis is configured
+_REDIS_AGENTS_KEY = "a2a:agents"
+_REDIS_EXPIRY_KEY = "a2a:agents:expiry"
+_REDIS_VERSION_KEY = "a2a:agents:version"
+
+def _redis_agent_key(agent_url: str) -> str:
+    return f"a2a:agent:{agent_url}"
+
+def _redis_skill_key(skill_id: str) -> str:
+    return f"a2a:skill:{skill_id}"
+
+async def store_agent(agent_url: str, card_dict: Dict[str, Any]) -> None:
+    """Registers (or refreshes) an agent's card and resets its TTL."""
+    global _agents_version
+    if redis_client is None:
+        _disco_cache.clear()
+        index_agent(agent_url, card_dict, old_card=registered_agents.get(agent_url))
+        registered_agents[agent_url] = card_dict
+        member = _dumpb(agent_url) + b":" + _dumpb(card_dict)
+        if registered_agents_bytes.get(agent_url) != member: # Heartbeats re-send the same card
+            registered_agents_bytes[agent_url] = member
+            _agents_version += 1
+        now = time.time()
+        agent_last_seen[agent_url] = now # Update last seen time
+        heapq.heappush(expiry_heap, (now + AGENT_TTL_SECONDS, agent_url))
+        return
+
+    card_bytes = _dumpb(card_dict)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(_redis_agent_key(agent_url)) # The previous card, to tell a change from a heartbeat
+    pipe.set(_redis_agent_key(agent_url), card_bytes, ex=AGENT_TTL_SECONDS)
+    pipe.zadd(_REDIS_EXPIRY_KEY, {agent_url: time.time() + AGENT_TTL_SECONDS})
+    pipe.expire(_REDIS_EXPIRY_KEY, AGENT_TTL_SECONDS)
+    for key in [_REDIS_AGENTS_KEY, *map(_redis_skill_key, _card_skill_ids(card_dict))]:
+        pipe.sadd(key, agent_url)
+        pipe.expire(key, AGENT_TTL_SECONDS)
+    old_card_bytes = (await pipe.execute())[0]
+    if old_card_bytes != card_bytes:
+        await redis_client.incr(_REDIS_VERSION_KEY)
+
+async def find_agents_for_skills(skill_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Maps each skill ID to the stored Agent Cards listing it (one round trip per stage in Redis)."""
+    if redis_client is None:
+        return {skill_id: find_agents_with_skill(skill_id) for skill_id in skill_ids}
+
+    pipe = redis_client.pipeline(transaction=False)
+    for skill_id in skill_ids:
+        pipe.smembers(_redis_skill_key(skill_id))
+    url_sets = [{url.decode() for url in members} for members in await pipe.execute()]
+    urls = list(set().union(*url_sets))
+    cards = {}
+    if urls:
+        for url, raw in zip(urls, await redis_client.mget([_redis_agent_key(url) for url in urls])):
+            if raw is not None:
+                cards[url] = _loads(raw)
+
+    found: Dict[str, List[Dict[str, Any]]] = {}
+    stale = redis_client.pipeline(transaction=False)
+    for skill_id, skill_urls in zip(skill_ids, url_sets):
+        found[skill_id] = []
+        for url in skill_urls:
+            card_dict = cards.get(url)
+            if card_dict is not None and skill_id in _card_skill_ids(card_dict):
+                found[skill_id].append(card_dict)
+            else:
+                stale.srem(_redis_skill_key(skill_id), url)
+    if len(stale):
+        await stale.execute()
+    return found
+
+async def registered_agents_etag() -> str:
+    """ETag of the current /agents document, taken from a version counter without building it."""
+    if redis_client is None:
+        return f'"{_TASK_ID_PREFIX}{_agents_version:x}"' # Per process, like the registry it versions
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zremrangebyscore(_REDIS_EXPIRY_KEY, "-inf", time.time())
+    pipe.get(_REDIS_VERSION_KEY)
+    expired, version = await pipe.execute()
+    if expired: # Cards that lapsed since the last check change the document too
+        version = await redis_client.incr(_REDIS_VERSION_KEY)
+    return f'"r{int(version or 0):x}"'
+
+async def registered_agents_body() -> bytes:
+    """The /agents JSON document, spliced from per-card bytes."""
+    if redis_client is None:
+        members = registered_agents_bytes.values()
+    else:
+        urls = [url.decode() for url in await redis_client.smembers(_REDIS_AGENTS_KEY)]
+        raws = await redis_client.mget([_redis_agent_key(url) for url in urls]) if urls else []
+        members = [_dumpb(url) + b":" + raw for url, raw in zip(urls, raws) if raw is not None]
+        expired = [url for url, raw in zip(urls, raws) if raw is None]
+        if expired:
+            await redis_client.srem(_REDIS_AGENTS_KEY, *expired)
+    return b'{"registered_agents":{' + b",".join(members) + b"}}"
+
+@app.on_event("startup")
+async def connect_storage():
+    global redis_client
+    if not REDIS_URL:
+        return
+    if aioredis is None:
+        log.error("[Registry] A2A_REDIS_URL is set but the 'redis' package is not installed; using in-memory storage.")
+        return
+    redis_client = aioredis.from_url(REDIS_URL)
+    log.info("[Registry] Using Redis storage at %s", REDIS_URL)
+
+@app.on_event("shutdown")
+async def close_storage():
+    if redis_client is not None:
+        await redis_client.aclose()
+
+
+# --- Background Pruning ---
+PRUNE_INTERVAL_SECONDS = AGENT_TTL_SECONDS / 10
+
+async def _prune_loop():
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+        try:
+            prune_expired_agents()
+        except Exception as e:
+            log.error("[Registry] Pruning failed: %s", e)
+
+@app.on_event("startup")
+async def start_pruning():
+    # Redis expires entries itself; the heap only tracks in-memory registrations
+    app.state.prune_task = asyncio.create_task(_prune_loop()) if redis_client is None else None
+
+@app.on_event("shutdown")
+async def stop_pruning():
+    if app.state.prune_task is not None:
+        app.state.prune_task.cancel()
 
 
 # --- A2A Endpoints ---
-@app.get("/.well-known/agent.json", response_model=AgentCardModel)
+@app.get("/.well-known/agent.json", responses={200: {"model": AgentCardModel}}) # Documented, never re-validated
 async def get_registry_agent_card():
     """Serves the registry's own Agent Card."""
-    return JSONResponse(content=REGISTRY_AGENT_CARD)
+    return Response(content=_REGISTRY_CARD_BYTES, media_type="application/json")
 
 @app.get("/agents", summary="List Registered Agents (Debug)")
-async def list_registered_agents():
-    """Debug endpoint to view currently registered agents."""
-    prune_expired_agents()
-    return JSONResponse(content={"registered_agents": registered_agents})
+async def list_registered_agents(request: Request):
+    """Debug endpoint to view currently registered agents. Supports If-None-Match revalidation."""
+    # Taken before the body: if the registry changes in between, the next poll just refetches
+    etag = await registered_agents_etag()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=await registered_agents_body(), media_type="application/json", headers={"ETag": etag})
+
+# --- tasks/send Skill Handlers ---
+# Each takes the DataPart content selected for it and returns the A2A Task to send back.
+async def _handle_register(task_id: str, agent_card_data: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        # Validate the received agent card data using Pydantic
+        agent_card = _AGENT_CARD_TA.validate_python(agent_card_data)
+        agent_url = agent_card.url
+
+        # Use the validated data (agent_card.model_dump()) for storage
+        card_dict = _AGENT_CARD_TA.dump_python(agent_card, exclude_none=True)
+        await store_agent(agent_url, card_dict)
+
+        log.info("[Registry] Registered/Updated agent: %s at %s", agent_card.name, agent_url)
+        return create_a2a_task_response(task_id, "completed", message_text="Agent registered successfully.")
+
+    except ValidationError as e:
+        log.error("[Registry] Invalid Agent Card format for registration: %s", e)
+        # Return success at JSON-RPC level but failure at Task level
+        return create_a2a_task_response(task_id, "failed", message_text=f"Invalid Agent Card format: {e}")
+    except Exception as e:
+        log.error("[Registry] Internal error during registration: %s", e)
+        # Handle unexpected errors during registration processing
+        return create_a2a_task_response(task_id, "failed", message_text=f"Internal server error during registration: {e}")
+
+async def _handle_discover(task_id: str, query_data: Dict[str, Any]) -> Dict[str, Any]:
+    required_skill_id = query_data.get("skill_id")
+    if not required_skill_id or not isinstance(required_skill_id, str):
+        return create_a2a_task_response(task_id, "failed", message_text="Invalid discovery query: 'skill_id' (string) is required in data part.")
+
+    log.debug("[Registry] Processing discovery for skill: '%s'", required_skill_id)
+    # Repeat JSON queries against the in-memory store reuse the serialized artifacts, spliced
+    # into the response as an orjson.Fragment (Redis state can change under other processes)
+    cacheable = orjson is not None and redis_client is None and _response_format.get() == "json"
+    cached = _disco_cache.get(required_skill_id) if cacheable else None
+    if cached is not None:
+        _disco_cache.move_to_end(required_skill_id)
+        log.info("[Registry] Discovery for skill '%s': Found %s agents (cached).", required_skill_id, cached[1])
+        return create_a2a_task_response(task_id, "completed", artifacts=orjson.Fragment(cached[0]))
+
+    # Wrap each matching agent card dict in an A2A DataPart structure for the artifact list
+    found = await find_agents_for_skills([required_skill_id])
+    matching_cards_artifacts = [{"type": _DATA_PART_TYPE, "data": card_dict} for card_dict in found[required_skill_id]]
+    if cacheable and matching_cards_artifacts:
+        _disco_cache[required_skill_id] = (orjson.dumps(matching_cards_artifacts), len(matching_cards_artifacts))
+        if len(_disco_cache) > DISCOVERY_CACHE_SIZE:
+            _disco_cache.popitem(last=False)
+
+    log.info("[Registry] Discovery for skill '%s': Found %s agents.", required_skill_id, len(matching_cards_artifacts))
+    return create_a2a_task_response(task_id, "completed", artifacts=matching_cards_artifacts)
+
+async def _handle_discover_batch(task_id: str, query_data: Dict[str, Any]) -> Dict[str, Any]:
+    required_skill_ids = query_data.get("skill_ids")
+    if not required_skill_ids or not isinstance(required_skill_ids, list) or not all(isinstance(s, str) and s for s in required_skill_ids):
+        return create_a2a_task_response(task_id, "failed", message_text="Invalid discovery query: 'skill_ids' (non-empty list of strings) is required in data part.")
+
+    log.debug("[Registry] Processing batch discovery for skills: %s", required_skill_ids)
+    # Each artifact carries the skill it matched in its metadata so the caller can group them
+    found = await find_agents_for_skills(list(dict.fromkeys(required_skill_ids)))
+    matching_cards_artifacts = [
+        {"type": _DATA_PART_TYPE, "data": card_dict, "metadata": {"skill_id": skill_id}}
+        for skill_id, cards in found.items()
+        for card_dict in cards
+    ]
+
+    log.info("[Registry] Batch discovery for %s skills: Found %s matches.", len(required_skill_ids), len(matching_cards_artifacts))
+    return create_a2a_task_response(task_id, "completed", artifacts=matching_cards_artifacts)
+
+_SKILL_HANDLERS = {
+    "register_agent": _handle_register,
+    "discover_agents": _handle_discover,
+    "discover_agents_batch": _handle_discover_batch,
+}
+
+def _select_skill(rpc_request: A2ARequest, task_id: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Picks the registry skill to run and the DataPart content to run it on."""
+    parts = rpc_request.params.message.parts
+    requested_skill = rpc_request.params.metadata.get("skill")
+    if requested_skill in _REGISTRY_SKILLS:
+        # The caller named the skill, so the first DataPart is its input as-is
+        data_content = next((part.data for part in parts if part.type == _DATA_PART_TYPE and isinstance(part.data, dict)), None)
+        if data_content is not None:
+            if requested_skill == "discover_agents" and "skill_ids" in data_content:
+                requested_skill = "discover_agents_batch"
+            log.debug("[Registry] Dispatching '%s' from params.metadata for Task ID: %s", requested_skill, task_id)
+            return requested_skill, data_content
+
+    # Otherwise look for DataParts first (legacy clients that do not name the skill)
+    for part in parts:
+        if part.type == _DATA_PART_TYPE:
+            data_content = part.data
+            if isinstance(data_content, dict):
+                keys = data_content.keys()
+                # Heuristic for Agent Card (Registration)
+                if _REG_KEYS <= keys:
+                    log.debug("[Registry] Detected Registration request for Task ID: %s", task_id)
+                    return "register_agent", data_content
+                # Heuristic for Discovery Query
+                elif "skill_id" in keys:
+                    log.debug("[Registry] Detected Discovery request for Task ID: %s", task_id)
+                    return "discover_agents", data_content
+                # Heuristic for Batch Discovery Query (several skills in one round trip)
+                elif "skill_ids" in keys:
+                    log.debug("[Registry] Detected Batch Discovery request for Task ID: %s", task_id)
+                    return "discover_agents_batch", data_content
+    return None, None
+
+async def _handle_tasks_send(rpc_request: A2ARequest, task_id: str) -> Dict[str, Any]:
+    skill_to_invoke, skill_input = _select_skill(rpc_request, task_id)
+    handler = _SKILL_HANDLERS.get(skill_to_invoke)
+    if handler is None or not skill_input:
+        # If no specific skill was determined from DataParts
+        log.error("[Registry] Could not determine intended operation (register/discover) or missing required data in message parts for Task ID %s.", task_id)
+        return create_a2a_task_response(task_id, "failed", message_text="Could not determine intended operation or missing required data. Use DataPart for agent card (register), {'skill_id': '...'} (discover) or {'skill_ids': [...]} (batch discover).")
+    return await handler(task_id, skill_input)
+
+# JSON-RPC method -> handler returning the A2A Task for the result field
+_METHODS = {
+    "tasks/send": _handle_tasks_send,
+}
+
 
 @app.post("/a2a", summary="A2A JSON-RPC Endpoint")
 async def handle_a2a_request(request: Request):
     """Handles incoming A2A JSON-RPC requests for registration and discovery."""
-    prune_expired_agents() # Prune before processing request
+    # Bind the globals this handler uses as locals (LOAD_FAST instead of LOAD_GLOBAL)
+    jsonrpc_response, jsonrpc_error, task_response = create_jsonrpc_response, create_jsonrpc_error, create_a2a_task_response
+    rpc_request = None
     request_id = None # Keep track of JSON-RPC request ID
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        _response_format.set("msgpack")
+    task_id = None
     try:
-        payload = await request.json()
-        # print(f"\n[Registry] Received A2A Request:\n{json.dumps(payload, indent=2)}") # Debug
-        request_id = payload.get("id")
-
-        # Validate basic JSON-RPC structure
-        if not all(k in payload for k in ["jsonrpc", "method", "params", "id"]):
-             return create_jsonrpc_error(-32600, "Invalid Request: Missing JSON-RPC fields.", request_id)
-
-        if payload["jsonrpc"] != "2.0":
-             return create_jsonrpc_error(-32600, "Invalid Request: Unsupported JSON-RPC version.", request_id)
-
-        method = payload.get("method")
-        params = payload.get("params", {})
-        task = params.get("task", {})
-        message = params.get("message", {})
-        parts = message.get("parts", [])
-        task_id = task.get("id", str(uuid.uuid4())) # Use provided task ID or generate one
-
-        if method == "tasks/send":
-            skill_to_invoke = None
-            query_data = None
-            agent_card_to_register_data = None
-
-            # Look for DataParts first
-            for part in parts:
-                if part.get("type") == "data":
-                    data_content = part.get("data", {})
-                    if isinstance(data_content, dict):
-                        # Heuristic for Agent Card (Registration)
-                        if "url" in data_content and "skills" in data_content and "name" in data_content:
-                            agent_card_to_register_data = data_content
-                            skill_to_invoke = "register_agent"
-                            print(f"[Registry] Detected Registration request for Task ID: {task_id}")
-                            break # Found registration data
-                        # Heuristic for Discovery Query
-                        elif "skill_id" in data_content:
-                            query_data = data_content
-                            skill_to_invoke = "discover_agents"
-                            print(f"[Registry] Detected Discovery request for Task ID: {task_id}")
-                            # Don't break yet, maybe a more specific data part exists later? Usually not needed.
-                            break # Found discovery data
-
-            # --- Registration Logic ---
-            if skill_to_invoke == "register_agent" and agent_card_to_register_data:
-                try:
-                    # Validate the received agent card data using Pydantic
-                    agent_card = AgentCardModel.model_validate(agent_card_to_register_data)
-                    agent_url = agent_card.url
-
-                    # Use the validated data (agent_card.model_dump()) for storage
-                    registered_agents[agent_url] = agent_card.model_dump(exclude_none=True)
-                    agent_last_seen[agent_url] = time.time() # Update last seen time
-
-                    print(f"[Registry] Registered/Updated agent: {agent_card.name} at {agent_url}")
-                    response_task = create_a2a_task_response(task_id, "completed", message_text="Agent registered successfully.")
-                    return create_jsonrpc_response(response_task, request_id)
-
-                except ValidationError as e:
-                    print(f"[Registry] ERROR: Invalid Agent Card format for registration: {e}")
-                    response_task = create_a2a_task_response(task_id, "failed", message_text=f"Invalid Agent Card format: {e}")
-                    # Return success at JSON-RPC level but failure at Task level
-                    return create_jsonrpc_response(response_task, request_id)
-                except Exception as e:
-                     print(f"[Registry] ERROR: Internal error during registration: {e}")
-                     # Handle unexpected errors during registration processing
-                     response_task = create_a2a_task_response(task_id, "failed", message_text=f"Internal server error during registration: {e}")
-                     return create_jsonrpc_response(response_task, request_id)
-
-
-            # --- Discovery Logic ---
-            elif skill_to_invoke == "discover_agents" and query_data:
-                required_skill_id = query_data.get("skill_id")
-                if not required_skill_id or not isinstance(required_skill_id, str):
-                    response_task = create_a2a_task_response(task_id, "failed", message_text="Invalid discovery query: 'skill_id' (string) is required in data part.")
-                    return create_jsonrpc_response(response_task, request_id)
-
-                print(f"[Registry] Processing discovery for skill: '{required_skill_id}'")
-                matching_cards_artifacts = []
-                for agent_url, card_dict in registered_agents.items():
-                    # Ensure skills is a list before iterating
-                    agent_skills = card_dict.get("skills", [])
-                    if isinstance(agent_skills, list):
-                        for skill in agent_skills:
-                            if isinstance(skill, dict) and skill.get("id") == required_skill_id:
-                                # Wrap the matching agent card dict in an A2A DataPart structure for the artifact list
-                                matching_cards_artifacts.append({"type": "data", "data": card_dict})
-                                print(f"[Registry] Found match: {card_dict.get('name')} at {agent_url}")
-                                break # Agent matches, no need to check other skills of the same agent
-
-                print(f"[Registry] Discovery for skill '{required_skill_id}': Found {len(matching_cards_artifacts)} agents.")
-                response_task = create_a2a_task_response(task_id, "completed", artifacts=matching_cards_artifacts)
-                return create_jsonrpc_response(response_task, request_id)
-
-            else:
-                # If no specific skill was determined from DataParts
-                print(f"[Registry] ERROR: Could not determine intended operation (register/discover) or missing required data in message parts for Task ID {task_id}.")
-                response_task = create_a2a_task_response(task_id, "failed", message_text="Could not determine intended operation or missing required data. Use DataPart for agent card (register) or {'skill_id': '...'} (discover).")
-                return create_jsonrpc_response(response_task, request_id)
-
-        else:
+        is_msgpack = request.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE)
+        if is_msgpack and msgpack is None:
+            # Replies are encoded with msgpack, so without it only JSON is accepted
+            return jsonrpc_error(-32600, "Unsupported Media Type: send application/json.", None, status_code=415)
+        decoder = _REQ_MSGPACK_DECODER if is_msgpack else _REQ_JSON_DECODER
+        body = await request.body()
+        try:
+            # Parses and validates the basic JSON-RPC structure in one step
+            rpc_request = decoder.decode(body)
+        except msgspec.ValidationError as e:
+            # The envelope parsed, so echo its id back if it carries a usable one
+            return jsonrpc_error(-32600, f"Invalid Request: {e}", request_id_of(body, is_msgpack))
+        except msgspec.DecodeError:
+            log.error("[Registry] Invalid %s payload.", 'msgpack' if is_msgpack else 'JSON')
+            return jsonrpc_error(-32700, f"Parse error: Invalid {'msgpack' if is_msgpack else 'JSON'}.", request_id)
+        request_id = rpc_request.id
+
+        if rpc_request.jsonrpc != "2.0":
+             return jsonrpc_error(-32600, "Invalid Request: Unsupported JSON-RPC version.", request_id)
+
+        method = rpc_request.method
+        task_id = rpc_request.params.task.id or new_task_id() # Use provided task ID or generate one
+
+        handler = _METHODS.get(method)
+        if handler is None:
             # Method not implemented (e.g., tasks/sendSubscribe, tasks/cancel)
-            print(f"[Registry] ERROR: Method '{method}' not implemented.")
+            log.error("[Registry] Method '%s' not implemented.", method)
             # Send JSON-RPC error for unsupported method
-            return create_jsonrpc_error(-32601, f"Method '{method}' not implemented.", request_id, status_code=501)
+            return jsonrpc_error(-32601, f"Method '{method}' not implemented.", request_id, status_code=501)
+        return jsonrpc_response(await handler(rpc_request, task_id), request_id)
 
-    except json.JSONDecodeError:
-        print("[Registry] ERROR: Invalid JSON payload.")
-        return create_jsonrpc_error(-32700, "Parse error: Invalid JSON.", request_id)
     except HTTPException as e:
         # Let FastAPI handle its own HTTPExceptions
         raise e
     except Exception as e:
-        print(f"[Registry] ERROR: Internal server error: {e}")
+        log.error("[Registry] Internal server error: %s", e)
         # Attempt to return a failed task response within JSON-RPC result field for unexpected errors
         # If task_id wasn't parsed, use a placeholder
-        task_id_fallback = task.get("id", "unknown-task-id") if 'task' in locals() else "unknown-task-id"
-        response_task = create_a2a_task_response(task_id_fallback, "failed", message_text=f"Internal server error: {e}")
+        task_id_fallback = task_id or "unknown-task-id"
+        response_task = task_response(task_id_fallback, "failed", message_text=f"Internal server error: {e}")
         # Ensure request_id is available, fallback if needed
-        request_id_fallback = request_id if request_id is not None else "unknown-req-id"
+        request_id_fallback = rpc_request.id if rpc_request is not None else "unknown-req-id"
 
         # Best effort to return a valid JSON-RPC response containing the failed task
         # Use status code 500 for internal server errors
-        return JSONResponse(status_code=500, content={"jsonrpc": "2.0", "result": response_task, "id": request_id_fallback})
+        return ORJSONResponse(status_code=500, content={"jsonrpc": "2.0", "result": response_task, "id": request_id_fallback})
 
 
 # --- Run Server ---
@@ -300,7 +731,8 @@ if __name__ == "__main__":
     print(f"Agent TTL: {AGENT_TTL_SECONDS} seconds")
     print(f"Debug Endpoint (List Agents): {REGISTRY_URL}/agents")
     print(f"-----------------------------------------")
-    # Use configured host and port
-    uvicorn.run(app, host=REGISTRY_HOST, port=REGISTRY_PORT)
+    if REGISTRY_WORKERS > 1 and not REDIS_URL:
+        log.warning("[Registry] Running %s workers: each process keeps its own in-memory registry.", REGISTRY_WORKERS)
+    serve(app, "registry_server:app", REGISTRY_HOST, REGISTRY_PORT, REGISTRY_WORKERS)
 
 # To run: python registry_server.py
\ No newline at end of file
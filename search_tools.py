@@ -0,0 +1,84 @@
+# search_tools.py
+# Agno toolkits used by the worker agent. Imported lazily by worker_agent_server when
+# its agent is first built, since agno is slow to import.
+import asyncio
+import json
+import os
+from typing import Any, List
+
+from agno.tools.duckduckgo import DuckDuckGoTools
+
+DDG_MAX_CONCURRENCY = int(os.getenv("DDG_MAX_CONCURRENCY", "5"))
+DDG_TIMEOUT_SECONDS = float(os.getenv("DDG_TIMEOUT_SECONDS", "8"))
+
+class ConcurrentDuckDuckGoTools(DuckDuckGoTools):
+    """
+    DuckDuckGoTools with async entry points, which Agno awaits directly. Every DuckDuckGo
+    request in the process shares one semaphore (DDG_MAX_CONCURRENCY) and is cut off
+    after DDG_TIMEOUT_SECONDS. duckduckgo_multi_search lets the model send several
+    queries in a single tool call, which then run concurrently.
+    """
+    _limit = asyncio.Semaphore(DDG_MAX_CONCURRENCY)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register(self.duckduckgo_multi_search)
+
+    async def _bounded(self, fn, query: str, max_results: int) -> str:
+        await self._limit.acquire()
+        # The DDGS client is blocking, so it runs on a thread. A thread can't be stopped,
+        # so the slot is released when the thread finishes, not when the caller gives up:
+        # a timed-out search keeps counting against DDG_MAX_CONCURRENCY while it runs.
+        try:
+            fut = asyncio.get_running_loop().run_in_executor(None, fn, query, max_results)
+        except BaseException:
+            self._limit.release()
+            raise
+        fut.add_done_callback(lambda _: self._limit.release())
+        return await asyncio.wait_for(asyncio.shield(fut), DDG_TIMEOUT_SECONDS)
+
+    async def duckduckgo_search(self, query: str, max_results: int = 5) -> str:
+        """Use this function to search DuckDuckGo for a query.
+
+        Args:
+            query(str): The query to search for.
+            max_results (optional, default=5): The maximum number of results to return.
+
+        Returns:
+            The result from DuckDuckGo.
+        """
+        return await self._bounded(super().duckduckgo_search, query, max_results)
+
+    async def duckduckgo_news(self, query: str, max_results: int = 5) -> str:
+        """Use this function to get the latest news from DuckDuckGo.
+
+        Args:
+            query(str): The query to search for.
+            max_results (optional, default=5): The maximum number of results to return.
+
+        Returns:
+            The latest news from DuckDuckGo.
+        """
+        return await self._bounded(super().duckduckgo_news, query, max_results)
+
+    async def duckduckgo_multi_search(self, queries: List[str], max_results: int = 5) -> str:
+        """Use this function to search DuckDuckGo for several queries at once.
+
+        Args:
+            queries(List[str]): The queries to search for.
+            max_results (optional, default=5): The maximum number of results per query.
+
+        Returns:
+            A JSON object mapping each query to its DuckDuckGo results.
+        """
+        search = super().duckduckgo_search
+
+        async def one(query: str) -> Any:
+            try:
+                return json.loads(await self._bounded(search, query, max_results))
+            except Exception as e: # One failed query shouldn't cancel its siblings
+                return {"error": f"{type(e).__name__}: {e}"}
+
+        async with asyncio.TaskGroup() as tg:
+            tasks = {query: tg.create_task(one(query)) for query in dict.fromkeys(queries)}
+        return json.dumps({query: task.result() for query, task in tasks.items()})
@@ -1,33 +1,55 @@
 # worker_agent_server.py
-import uuid
-
-import uvicorn
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import httpx
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
 import json
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
 import os
+import logging
 import datetime
-import time
+import functools
+import contextlib
+import concurrent.futures
+import importlib.util
+import tempfile
+import msgspec
 from dotenv import load_dotenv
+try:
+    import fcntl
+except ImportError: # Not on Windows; every process registers there (registration is idempotent)
+    fcntl = None
 
-# Agno imports
-from agno.agent import Agent
-from agno.tools.duckduckgo import DuckDuckGoTools
-from agno.models.groq import Groq # Or OpenAIChat, AnthropicChat etc.
+# Agno is imported lazily in _get_agent
+if TYPE_CHECKING:
+    from agno.agent import Agent
 
 # Local A2A tool import
 from agno_a2a_tools import register_with_registry
 # Import models/helpers from registry (or duplicate if preferred)
-from registry_server import AgentCardModel, create_a2a_task_response, create_jsonrpc_response, create_jsonrpc_error
+from registry_server import (
+    AgentCardModel, A2APart, A2ARequest, MSGPACK_MEDIA_TYPE, ORJSONResponse, _dumpb, _loads, attach_queued_handler, new_task_id,
+    create_a2a_task_response, create_jsonrpc_response, create_jsonrpc_error, request_id_of, serve,
+)
 
 load_dotenv()
 
+# Same queued stderr handler as the registry; A2A_LOG_LEVEL sets the level for both
+log = logging.getLogger("worker")
+log.setLevel(os.getenv("A2A_LOG_LEVEL", "WARNING").upper())
+attach_queued_handler(log)
+
 # --- Worker Agent Configuration ---
 WORKER_HOST = "0.0.0.0"
 WORKER_PORT = int(os.getenv("WORKER_PORT", 8001))
 WORKER_URL = os.getenv("WORKER_AGENT_URL", f"http://localhost:{WORKER_PORT}")
 REGISTRY_URL = os.getenv("A2A_REGISTRY_URL", "http://localhost:8000")
+# Server processes. Each one builds its own agents and warms up on its own, so raise this
+# only when one process's event loop is saturated
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 1))
 
 # --- Define the Agent's Card ---
 # Ensure this matches the AgentCardModel structure from registry_server
@@ -37,7 +59,7 @@ MY_AGENT_CARD = AgentCardModel(
     description="An Agno agent that searches the web using DuckDuckGo and provides concise results.",
     url=f"{WORKER_URL}",
     version="1.1.0",
-    capabilities={"streaming": False, "pushNotifications": False, "stateTransitionHistory": False},
+    capabilities={"streaming": True, "pushNotifications": False, "stateTransitionHistory": False},
     authentication={"schemes": []}, # No auth for simplicity
     skills=[
         {
@@ -50,283 +72,510 @@ MY_AGENT_CARD = AgentCardModel(
         }
     ]
 )
-MY_AGENT_CARD_JSON = MY_AGENT_CARD.model_dump_json() # Get JSON string from Pydantic model
-
-# --- Initialize Agno Agent Core Logic ---
-print("[Worker Agent] Initializing Agno core...")
-# Ensure you have GROQ_API_KEY in your .env or provide model credentials another way
-try:
-    # Check for API key before initializing the model
-    if not os.getenv("GROQ_API_KEY"):
-         print("WARNING: GROQ_API_KEY not found in environment. Agent may not function.")
-         # You might want to raise an error or use a fallback model here
-         # For demo purposes, we'll let it proceed, but tool calls will fail.
-
-    web_searcher_agent = Agent(
+# Serialized once, straight through pydantic-core; served by /.well-known/agent.json
+MY_AGENT_CARD_BYTES = MY_AGENT_CARD.__pydantic_serializer__.to_json(MY_AGENT_CARD, exclude_none=True)
+MY_AGENT_CARD_DICT = _loads(MY_AGENT_CARD_BYTES) # Registered as-is on every attempt, no re-dump
+
+# --- Agno Agent Core Logic ---
+# The agent (and the agno imports behind it) is built on first use, from startup_event,
+# rather than at import: a multi-process parent that only supervises never pays for it.
+AGNO_DEBUG = os.getenv("AGNO_DEBUG", "").lower() in ("1", "true", "yes")
+# Joined once, in the same "- item" form Agno renders an instruction list in
+_AGENT_INSTRUCTIONS = "\n".join(f"- {line}" for line in (
+    "Understand the user query provided.",
+    "Use the DuckDuckGo search tool to find relevant web pages.",
+    "If the query needs several separate searches, make them with one duckduckgo_multi_search call.",
+    "Summarize the key findings from the search results concisely.",
+    "Return only the summarized findings as plain text.",
+    "Do not include conversational filler like 'Okay, here are the results...'.",
+))
+
+def _build_agent() -> "Agent":
+    from agno.agent import Agent
+    from agno.models.groq import Groq # Or OpenAIChat, AnthropicChat etc.
+    from search_tools import ConcurrentDuckDuckGoTools
+    return Agent(
        model=Groq(id="meta-llama/llama-4-scout-17b-16e-instruct"), # Using Groq Llama3-8b for speed
        # model=OpenAIChat(model="gpt-3.5-turbo"), # Or OpenAI
        description="You are a web search assistant. Use the DuckDuckGo tool to find information.",
-       tools=[DuckDuckGoTools(fixed_max_results=3)], # Use DuckDuckGo, limit results
-       instructions=[
-           "Understand the user query provided.",
-           "Use the DuckDuckGo search tool to find relevant web pages.",
-           "Summarize the key findings from the search results concisely.",
-           "Return only the summarized findings as plain text.",
-           "Do not include conversational filler like 'Okay, here are the results...'."
-        ],
-       show_tool_calls=True, # Show tool calls for debugging
-       debug_mode=True
+       tools=[ConcurrentDuckDuckGoTools(fixed_max_results=3)], # Use DuckDuckGo, limit results
+       instructions=_AGENT_INSTRUCTIONS,
+       show_tool_calls=AGNO_DEBUG, # Agno's debug output goes straight to stdout on every run
+       debug_mode=AGNO_DEBUG
     )
-    print("[Worker Agent] Agno core initialized successfully.")
-except Exception as e:
-    print(f"[Worker Agent] FATAL ERROR initializing Agno agent: {e}")
-    # Optionally, exit if the core agent fails to load
-    # exit(1)
-    web_searcher_agent = None # Ensure it's None if init fails
+
+# Agno keeps per-run state (run_response, run_messages, ...) on the Agent instance, so two
+# runs on one Agent at the same time can swap answers. Each run checks out an agent of its
+# own; idle ones are reused, and _INFLIGHT caps how many ever get built.
+_INFLIGHT = asyncio.Semaphore(int(os.getenv("MAX_INFLIGHT", "16")))
+_idle_agents: List["Agent"] = []
+
+@functools.lru_cache(maxsize=1)
+def _get_agent() -> Optional["Agent"]:
+    """Builds the first Agno agent (seeding the idle pool with it), or None if that fails."""
+    log.info("[Worker Agent] Initializing Agno core...")
+    # Ensure you have GROQ_API_KEY in your .env or provide model credentials another way
+    try:
+        # Check for API key before initializing the model
+        if not os.getenv("GROQ_API_KEY"):
+             log.warning("[Worker Agent] GROQ_API_KEY not found in environment. Agent may not function.")
+             # You might want to raise an error or use a fallback model here
+             # For demo purposes, we'll let it proceed, but tool calls will fail.
+        agent = _build_agent()
+        log.info("[Worker Agent] Agno core initialized successfully.")
+        _idle_agents.append(agent)
+        return agent
+    except Exception as e:
+        log.error("[Worker Agent] Fatal error initializing Agno agent: %s", e)
+        # Optionally, exit if the core agent fails to load
+        # exit(1)
+        return None # Cached too, so a broken setup isn't retried per request
+
+@contextlib.asynccontextmanager
+async def _checkout_agent() -> AsyncIterator["Agent"]:
+    """Holds an _INFLIGHT slot and an agent no other run is using."""
+    async with _INFLIGHT:
+        agent = _idle_agents.pop() if _idle_agents else _build_agent()
+        try:
+            yield agent
+        finally:
+            _idle_agents.append(agent)
 
 # --- Wrapper function for Agno Agent ---
-def perform_search_task(query: str) -> str:
+async def perform_search_task(query: str) -> str:
     """
     Uses the initialized Agno agent to perform a search.
     Returns the text response from the agent.
     """
-    if not web_searcher_agent:
+    if not _get_agent():
         return "Error: Web search agent core is not initialized."
     if not query or not isinstance(query, str):
         return "Error: Search query must be a non-empty string."
 
-    print(f"\n[Worker Agent] Received search task for query: '{query}'")
+    log.debug("[Worker Agent] Received search task for query: '%s'", query)
     try:
-        # Use .chat() for conversational interaction leading to tool use
-        response = web_searcher_agent.run(query)
-        print(f"[Worker Agent] Agno response: {response}")
-        return response if isinstance(response, str) else str(response)
+        # Agno's async entry point keeps the event loop free during the LLM and search calls
+        async with _checkout_agent() as agent:
+            # stream=False is explicit: Agno latches agent.stream on after any streamed run
+            response = await agent.arun(query, stream=False)
+        log.debug("[Worker Agent] Agno response: %s", response)
+        content = getattr(response, "content", response) # RunResponse -> its text
+        return content if isinstance(content, str) else str(content)
     except Exception as e:
-        print(f"[Worker Agent] ERROR during Agno agent execution: {e}")
+        log.error("[Worker Agent] Error during Agno agent execution: %s", e)
         return f"Error during search: {e}"
 
-# --- FastAPI App for A2A Server ---
-app = FastAPI(title=MY_AGENT_CARD.name)
+# --- Query Coalescer ---
+# Searches arriving within BATCH_WINDOW_MS of each other (up to BATCH_MAX) are merged into
+# one numbered prompt and a single agent run, then the answers are split back per caller.
+# Each window is first split into similarity buckets keyed by a query's leading words, so
+# a batch holds queries on a shared topic whose prompts share a prefix. Within a bucket,
+# queries are binned by length so one long query doesn't hold up a batch of short ones.
+# A query with no similar company runs on its own. Batching puts queries from different
+# callers in one prompt, so it is off unless BATCH_MAX is raised above 1.
+BATCH_MAX = int(os.getenv("BATCH_MAX", "1"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "20"))
+BATCH_BUCKET_WORDS = int(os.getenv("BATCH_BUCKET_WORDS", "2")) # Leading words that decide a query's bucket
+_batch_queue: "asyncio.Queue[Tuple[str, asyncio.Future]]" = asyncio.Queue()
+_coalescer_task: Optional[asyncio.Task] = None
+
+def _bucket(query: str) -> str:
+    return " ".join(query.lower().split()[:BATCH_BUCKET_WORDS])
+
+def _similarity_buckets(batch: List[Tuple[str, asyncio.Future]]) -> List[List[Tuple[str, asyncio.Future]]]:
+    """Groups a batch by _bucket, keeping arrival order; unrelated queries never share one."""
+    buckets: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+    for item in batch:
+        buckets.setdefault(_bucket(item[0]), []).append(item)
+    return list(buckets.values())
+
+def _shared_topic(queries: List[str]) -> str:
+    """The leading words every query starts with (case-insensitive), or ''."""
+    words = [query.split() for query in queries]
+    common = []
+    for column in zip(*words):
+        if any(word.lower() != column[0].lower() for word in column):
+            break
+        common.append(column[0])
+    return " ".join(common)
+
+def _length_bins(batch: List[Tuple[str, asyncio.Future]]) -> List[List[Tuple[str, asyncio.Future]]]:
+    """Splits a batch into bins of queries within 2x of each other's length."""
+    bins: List[List[Tuple[str, asyncio.Future]]] = []
+    for item in sorted(batch, key=lambda item: len(item[0])):
+        if bins and len(item[0]) <= 2 * len(bins[-1][0][0]):
+            bins[-1].append(item)
+        else:
+            bins.append([item])
+    return bins
 
-@app.on_event("startup")
-async def startup_event():
-    """Register with the registry on startup."""
-    print(f"\n[Worker Agent] Startup: Attempting registration with registry at {REGISTRY_URL}")
-    if not REGISTRY_URL:
-        print("[Worker Agent] WARNING: A2A_REGISTRY_URL not set. Skipping registration.")
+def _resolve(fut: asyncio.Future, result: str) -> None:
+    if not fut.done(): # The caller may have gone away
+        fut.set_result(result)
+
+async def _run_batch(items: List[Tuple[str, asyncio.Future]]) -> None:
+    if len(items) == 1:
+        query, fut = items[0]
+        _resolve(fut, await perform_search_task(query))
         return
 
+    topic = _shared_topic([query for query, _ in items])
+    prompt = "\n".join(
+        [f"You will answer {len(items)} queries that share the topic: {topic}." if topic else
+         "Answer each of the following independent search queries separately."]
+        + [f"Q{i}: {query}" for i, (query, _) in enumerate(items, 1)]
+        + ['Return ONLY a JSON object mapping each query number to its summarized findings, e.g. {"1": "...", "2": "..."}.']
+    )
+    log.debug("[Worker Agent] Running %s coalesced queries in one agent run", len(items))
+    result_text = await perform_search_task(prompt)
+    if result_text.startswith("Error"):
+        for _, fut in items:
+            _resolve(fut, result_text)
+        return
+
+    try:
+        # Tolerate the model wrapping its JSON in a code fence
+        answers = _loads(result_text[result_text.index("{"):result_text.rindex("}") + 1])
+    except ValueError:
+        answers = {}
+    missing = []
+    for i, (query, fut) in enumerate(items, 1):
+        answer = answers.get(str(i)) if isinstance(answers, dict) else None
+        if isinstance(answer, str) and answer:
+            _resolve(fut, answer)
+        else:
+            missing.append((query, fut))
+    if missing:
+        # Anything the batched answer didn't cover is re-run on its own
+        log.warning("[Worker Agent] Coalesced run missed %s of %s answers; re-running them individually", len(missing), len(items))
+        await asyncio.gather(*(_run_batch([item]) for item in missing))
+
+async def _run_batch_guarded(items: List[Tuple[str, asyncio.Future]]) -> None:
+    try:
+        await _run_batch(items)
+    except Exception as e: # Never leave a caller waiting on a future nobody will resolve
+        log.error("[Worker Agent] Coalesced batch failed: %s", e)
+        for _, fut in items:
+            _resolve(fut, f"Error during search: {e}")
+
+async def _coalesce_forever() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_MS / 1000
+        while len(batch) < BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Batches run concurrently (bounded by _INFLIGHT) while the next window fills
+        for bucket in _similarity_buckets(batch):
+            for items in _length_bins(bucket):
+                asyncio.create_task(_run_batch_guarded(items))
+
+async def submit_search(query: str) -> str:
+    """Runs a search through the coalescer when it is active, otherwise directly."""
+    if _coalescer_task is None or _coalescer_task.done():
+        return await perform_search_task(query)
+    fut = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((query, fut))
+    return await fut
+
+# --- Search Result Cache ---
+# Successful results are kept per normalized query (case and whitespace folded) for
+# SEARCH_CACHE_TTL seconds, with the least recently used entry evicted past
+# SEARCH_CACHE_SIZE. Concurrent calls for a query already being searched share that
+# one search. SEARCH_CACHE_SIZE=0 turns the cache off.
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+_search_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict() # key -> (expiry, result)
+_search_inflight: Dict[str, asyncio.Task] = {}
+
+async def _search_and_cache(key: str, query: str) -> str:
+    try:
+        result = await submit_search(query)
+    finally:
+        _search_inflight.pop(key, None)
+    if not result.startswith("Error"): # Failures are retried on the next call, not cached
+        _search_cache[key] = (time.monotonic() + SEARCH_CACHE_TTL, result)
+        if len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+    return result
+
+async def search(query: str) -> str:
+    """Entry point for the handlers: cache, then the coalescer, then the agent."""
+    if SEARCH_CACHE_SIZE <= 0:
+        return await submit_search(query)
+    key = " ".join(query.lower().split())
+    hit = _search_cache.get(key)
+    if hit is not None:
+        if hit[0] > time.monotonic():
+            _search_cache.move_to_end(key)
+            return hit[1]
+        del _search_cache[key]
+    task = _search_inflight.get(key)
+    if task is None:
+        # The search runs as its own task so a caller that disconnects doesn't cancel it
+        # for everyone else waiting on the same query
+        task = _search_inflight[key] = asyncio.create_task(_search_and_cache(key, query))
+    return await asyncio.shield(task)
+
+# --- FastAPI App for A2A Server ---
+app = FastAPI(title=MY_AGENT_CARD.name, default_response_class=ORJSONResponse)
+
+# One pooled client per server process, created on its event loop at startup and kept on
+# app.state.http, so registration retries and any other outbound calls reuse connections
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+def _create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_HTTP2,
+        timeout=httpx.Timeout(5.0, connect=2.0),
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=128),
+    )
+
+# With several server processes only one should register: the first to take this lock
+# holds it (via the open file) for its lifetime, the others skip registration.
+_REGISTRATION_LOCK_PATH = os.path.join(tempfile.gettempdir(), f"a2a-worker-{WORKER_PORT}.lock")
+_registration_lock_file = None
+
+def _claim_registration() -> bool:
+    global _registration_lock_file
+    if fcntl is None or _registration_lock_file is not None:
+        return True
+    lock_file = open(_REGISTRATION_LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _registration_lock_file = lock_file
+    return True
+
+_registration_task: Optional[asyncio.Task] = None
+
+async def _register_in_background():
+    """Registers with the registry, retrying while the server is already serving requests."""
     # Retry registration a few times in case the registry isn't ready immediately
     max_retries = 3
     retry_delay = 5 # seconds
     for attempt in range(max_retries):
-        print(f"[Worker Agent] Registration attempt {attempt + 1}/{max_retries}...")
-        result_json = register_with_registry(REGISTRY_URL, MY_AGENT_CARD_JSON)
+        log.debug("[Worker Agent] Registration attempt %s/%s...", attempt + 1, max_retries)
+        result_json = await register_with_registry(REGISTRY_URL, MY_AGENT_CARD_DICT, client=app.state.http)
         try:
             result_data = json.loads(result_json)
             # Check for explicit error key OR if the task status is not completed
             if "error" in result_data or result_data.get("status", {}).get("state") != "completed":
-                 print(f"[Worker Agent] WARNING: Registration failed (Attempt {attempt + 1}). Response: {result_json}")
+                 log.warning("[Worker Agent] Registration failed (Attempt %s). Response: %s", attempt + 1, result_json)
                  if attempt < max_retries - 1:
-                     print(f"[Worker Agent] Retrying registration in {retry_delay} seconds...")
-                     time.sleep(retry_delay)
+                     log.info("[Worker Agent] Retrying registration in %s seconds...", retry_delay)
+                     await asyncio.sleep(retry_delay) # Don't block the event loop while waiting
                  else:
-                     print("[Worker Agent] ERROR: Max registration retries reached.")
+                     log.error("[Worker Agent] Max registration retries reached.")
             else:
-                print("[Worker Agent] Successfully registered with the registry.")
+                log.info("[Worker Agent] Successfully registered with the registry.")
                 return # Exit loop on success
         except json.JSONDecodeError:
-            print(f"[Worker Agent] WARNING: Could not parse registration response JSON (Attempt {attempt + 1}): {result_json}")
+            log.warning("[Worker Agent] Could not parse registration response JSON (Attempt %s): %s", attempt + 1, result_json)
             if attempt < max_retries - 1:
-                print(f"[Worker Agent] Retrying registration in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                log.info("[Worker Agent] Retrying registration in %s seconds...", retry_delay)
+                await asyncio.sleep(retry_delay) # Don't block the event loop while waiting
             else:
-                print("[Worker Agent] ERROR: Max registration retries reached after JSON parse error.")
+                log.error("[Worker Agent] Max registration retries reached after JSON parse error.")
         except Exception as e:
-            print(f"[Worker Agent] ERROR: Unexpected error during registration attempt {attempt + 1}: {e}")
+            log.error("[Worker Agent] Unexpected error during registration attempt %s: %s", attempt + 1, e)
             # Decide if retry makes sense for this error type
             break # Stop retrying on unexpected errors
 
+# One throwaway agent run and a registry request at startup, so the first real task
+# doesn't pay for the TLS handshakes to Groq/DuckDuckGo and the registry. It costs one
+# LLM call per server process, so it is off unless WORKER_WARMUP=1.
+WORKER_WARMUP = os.getenv("WORKER_WARMUP", "0").lower() in ("1", "true", "yes")
+WARMUP_TIMEOUT_SECONDS = 10
+_warmup_task: Optional[asyncio.Task] = None
+
+async def _warmup():
+    if REGISTRY_URL:
+        try:
+            await app.state.http.get(f"{REGISTRY_URL.rstrip('/')}/.well-known/agent.json")
+        except httpx.HTTPError as e:
+            log.debug("[Worker Agent] Registry warmup request failed: %s", e)
+    if _get_agent() is not None:
+        try:
+            async with _checkout_agent() as agent:
+                await asyncio.wait_for(agent.arun("warmup, reply with 'ok'", stream=False), WARMUP_TIMEOUT_SECONDS)
+            log.debug("[Worker Agent] Agno agent warmed up.")
+        except Exception as e: # Includes the timeout; a failed warmup only means a colder first request
+            log.debug("[Worker Agent] Agno warmup run failed: %s", e)
+
+# Blocking work started with asyncio.to_thread (the DuckDuckGo client, and any sync tool
+# Agno runs) goes to a dedicated, sized pool instead of the loop's implicit default one
+TOOL_POOL_SIZE = int(os.getenv("TOOL_POOL", "32"))
+_tool_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
 
-@app.get("/.well-known/agent.json", response_model=AgentCardModel)
+@app.on_event("startup")
+async def startup_event():
+    """Register with the registry on startup."""
+    global _coalescer_task, _registration_task, _warmup_task, _tool_pool
+    _tool_pool = concurrent.futures.ThreadPoolExecutor(max_workers=TOOL_POOL_SIZE, thread_name_prefix="tool")
+    asyncio.get_running_loop().set_default_executor(_tool_pool)
+    app.state.http = _create_http_client()
+    _get_agent() # Build the agent before the first request; cached from here on
+    if BATCH_MAX > 1:
+        _coalescer_task = asyncio.create_task(_coalesce_forever())
+    if WORKER_WARMUP:
+        _warmup_task = asyncio.create_task(_warmup())
+    if not _claim_registration():
+        log.debug("[Worker Agent] Another server process handles registration (pid %s).", os.getpid())
+        return
+    log.info("[Worker Agent] Startup: Attempting registration with registry at %s", REGISTRY_URL)
+    if not REGISTRY_URL:
+        log.warning("[Worker Agent] A2A_REGISTRY_URL not set. Skipping registration.")
+        return
+    # Startup returns right away so the retry backoff never delays serving
+    _registration_task = asyncio.create_task(_register_in_background())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (_coalescer_task, _registration_task, _warmup_task):
+        if task is not None:
+            task.cancel()
+    await app.state.http.aclose()
+    if _tool_pool is not None:
+        _tool_pool.shutdown(wait=False, cancel_futures=True)
+
+# The schema only feeds the OpenAPI docs; MY_AGENT_CARD was validated when it was built
+@app.get("/.well-known/agent.json", responses={200: {"model": AgentCardModel}})
 async def get_agent_card():
     """Serves this agent's Agent Card."""
-    return JSONResponse(content=MY_AGENT_CARD.model_dump(exclude_none=True))
+    return Response(content=MY_AGENT_CARD_BYTES, media_type="application/json")
+
+async def _handle_tasks_send(task_id: str, parts: List[A2APart]) -> Dict[str, Any]:
+    """Runs a web search on the first TextPart and returns the resulting A2A Task."""
+    # Use the first text part found
+    query_text = next((part.text for part in parts if part.type == "text"), None)
+
+    if not query_text:
+        # No suitable TextPart found for the query
+        log.error("[Worker Agent] No 'text' part found in message for task %s", task_id)
+        return create_a2a_task_response(task_id, "failed", message_text="Required 'text' part missing in the input message.")
+
+    # Check if the agent core is initialized
+    if _get_agent() is None:
+         log.error("[Worker Agent] Agent core not initialized, cannot process task.")
+         return create_a2a_task_response(task_id, "failed", message_text="Agent core initialization failed.")
+
+    # Execute the core Agno logic
+    search_result_text = await search(query_text)
+
+    # Determine task status based on result
+    if search_result_text.startswith("Error:"):
+         return create_a2a_task_response(task_id, "failed", message_text=search_result_text)
+    # Package the result text into an A2A TextPart artifact
+    return create_a2a_task_response(task_id, "completed", artifacts=[{"type": "text", "text": search_result_text}])
+
+async def _stream_search_events(task_id: str, query_text: str, request_id: Any) -> AsyncIterator[bytes]:
+    """SSE events for one streamed search: {"delta": ...} per chunk, then the final JSON-RPC reply."""
+    chunks: List[str] = []
+    try:
+        async with _checkout_agent() as agent:
+            async for event in await agent.arun(query_text, stream=True):
+                delta = getattr(event, "content", None)
+                if isinstance(delta, str) and delta: # Tool-call and other non-text events are skipped
+                    chunks.append(delta)
+                    yield b"data: " + _dumpb({"delta": delta}) + b"\n\n"
+        task = create_a2a_task_response(task_id, "completed", artifacts=[{"type": "text", "text": "".join(chunks)}])
+    except Exception as e:
+        log.error("[Worker Agent] Error during streamed Agno run: %s", e)
+        task = create_a2a_task_response(task_id, "failed", message_text=f"Error during search: {e}")
+    yield b"data: " + _dumpb({"jsonrpc": "2.0", "result": task, "id": request_id}) + b"\n\n"
+
+async def _handle_tasks_send_subscribe(task_id: str, parts: List[A2APart], request_id: Any) -> Response:
+    """tasks/send with the agent's output streamed back as server-sent events."""
+    query_text = next((part.text for part in parts if part.type == "text"), None)
+    if not query_text:
+        log.error("[Worker Agent] No 'text' part found in message for task %s", task_id)
+        task = create_a2a_task_response(task_id, "failed", message_text="Required 'text' part missing in the input message.")
+        return create_jsonrpc_response(task, request_id)
+    if _get_agent() is None:
+        log.error("[Worker Agent] Agent core not initialized, cannot process task.")
+        task = create_a2a_task_response(task_id, "failed", message_text="Agent core initialization failed.")
+        return create_jsonrpc_response(task, request_id)
+    # Streamed runs go straight to the agent, past the result cache and the coalescer
+    return StreamingResponse(_stream_search_events(task_id, query_text, request_id), media_type="text/event-stream")
+
+# Same envelope structs as the registry: one native decode both parses and validates
+# the request, so the handler reads typed fields instead of walking dicts
+_REQ_DECODER = msgspec.json.Decoder(A2ARequest)
+
+# Methods answered with a single Task in the JSON-RPC result, keyed by method name
+_METHODS = {
+    "tasks/send": _handle_tasks_send,
+}
+# tasks/sendSubscribe builds its own response: an SSE stream, or a plain JSON-RPC reply on bad input
+_STREAM_METHODS = {
+    "tasks/sendSubscribe": _handle_tasks_send_subscribe,
+}
+
+async def _dispatch(rpc_request: A2ARequest) -> Response:
+    """Validates the version and runs the requested method; shared by every A2A route."""
+    request_id = rpc_request.id
+    if rpc_request.jsonrpc != "2.0":
+         return create_jsonrpc_error(-32600, "Invalid Request: Unsupported JSON-RPC version.", request_id)
+
+    method = rpc_request.method
+    stream_handler = _STREAM_METHODS.get(method)
+    if stream_handler is not None:
+        task_id = rpc_request.params.task.id or new_task_id()
+        return await stream_handler(task_id, rpc_request.params.message.parts, request_id)
+    handler = _METHODS.get(method)
+    if handler is None:
+        # Method not supported by this worker
+        log.error("[Worker Agent] Method '%s' not implemented.", method)
+        return create_jsonrpc_error(-32601, f"Method '{method}' not implemented by this agent.", request_id, status_code=501)
+    task_id = rpc_request.params.task.id or new_task_id()
+    return create_jsonrpc_response(await handler(task_id, rpc_request.params.message.parts), request_id)
 
 @app.post("/a2a", summary="A2A JSON-RPC Endpoint for Worker")
 async def handle_a2a_task(request: Request):
     """Handles incoming A2A tasks for this worker agent."""
-    request_id = None
+    rpc_request = None
+    if request.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+        # Only JSON is spoken here; 415 tells msgpack-capable clients to fall back
+        return create_jsonrpc_error(-32600, "Unsupported Media Type: send application/json.", None, status_code=415)
     try:
-        payload = await request.json()
-        # print(f"\n[Worker Agent] Received A2A Request:\n{json.dumps(payload, indent=2)}") # Debug
-        request_id = payload.get("id")
-
-        # Basic JSON-RPC validation
-        if not all(k in payload for k in ["jsonrpc", "method", "params", "id"]):
-             return create_jsonrpc_error(-32600, "Invalid Request: Missing JSON-RPC fields.", request_id)
-        if payload["jsonrpc"] != "2.0":
-             return create_jsonrpc_error(-32600, "Invalid Request: Unsupported JSON-RPC version.", request_id)
-
-        method = payload.get("method")
-        params = payload.get("params", {})
-        task = params.get("task", {})
-        message = params.get("message", {})
-        parts = message.get("parts", [])
-        task_id = task.get("id", str(uuid.uuid4()))
-
-        if method == "tasks/send":
-            # Find the query text within the message parts
-            query_text = None
-            for part in parts:
-                if part.get("type") == "text":
-                    query_text = part.get("text")
-                    break # Use the first text part found
-
-            if query_text:
-                # Check if the agent core is initialized
-                if web_searcher_agent is None:
-                     print("[Worker Agent] ERROR: Agent core not initialized, cannot process task.")
-                     response_task = create_a2a_task_response(task_id, "failed", message_text="Agent core initialization failed.")
-                     return create_jsonrpc_response(response_task, request_id)
-
-                # Execute the core Agno logic
-                search_result_text = perform_search_task(query_text)
-
-                # Determine task status based on result
-                if search_result_text.startswith("Error:"):
-                     task_status = "failed"
-                     message_text = search_result_text
-                     artifacts = []
-                else:
-                     task_status = "completed"
-                     message_text = "Search task completed." # Optional status message
-                     # Package the result text into an A2A TextPart artifact
-                     artifacts = [{"type": "text", "text": search_result_text}]
-
-                response_task = create_a2a_task_response(task_id, task_status, artifacts=artifacts, message_text=message_text if task_status=="failed" else None)
-                return create_jsonrpc_response(response_task, request_id)
-            else:
-                # No suitable TextPart found for the query
-                print(f"[Worker Agent] ERROR: No 'text' part found in message for task {task_id}")
-                response_task = create_a2a_task_response(task_id, "failed", message_text="Required 'text' part missing in the input message.")
-                return create_jsonrpc_response(response_task, request_id)
-
-        else:
-            # Method not supported by this worker
-            print(f"[Worker Agent] ERROR: Method '{method}' not implemented.")
-            return create_jsonrpc_error(-32601, f"Method '{method}' not implemented by this agent.", request_id, status_code=501)
-
-    except json.JSONDecodeError:
-        print("[Worker Agent] ERROR: Invalid JSON payload.")
-        return create_jsonrpc_error(-32700, "Parse error: Invalid JSON.", request_id)
+        body = await request.body()
+        try:
+            rpc_request = _REQ_DECODER.decode(body)
+        except msgspec.ValidationError as e:
+            return create_jsonrpc_error(-32600, f"Invalid Request: {e}", request_id_of(body))
+        return await _dispatch(rpc_request)
+
+    except msgspec.DecodeError:
+        log.error("[Worker Agent] Invalid JSON payload.")
+        return create_jsonrpc_error(-32700, "Parse error: Invalid JSON.", None)
     except Exception as e:
-        print(f"[Worker Agent] ERROR: Internal server error: {e}")
-        task_id_fallback = task.get("id", "unknown-task-id") if 'task' in locals() else "unknown-task-id"
+        log.error("[Worker Agent] Internal server error: %s", e)
+        task_id_fallback = (rpc_request and rpc_request.params.task.id) or "unknown-task-id"
         response_task = create_a2a_task_response(task_id_fallback, "failed", message_text=f"Internal server error processing task: {e}")
-        request_id_fallback = request_id if request_id is not None else "unknown-req-id"
-        return JSONResponse(status_code=500, content={"jsonrpc": "2.0", "result": response_task, "id": request_id_fallback})
+        request_id_fallback = rpc_request.id if rpc_request is not None else "unknown-req-id"
+        return ORJSONResponse(status_code=500, content={"jsonrpc": "2.0", "result": response_task, "id": request_id_fallback})
 
-@app.post("/a2a/a2a", summary="A2A JSON-RPC Endpoint for Worker")
-async def handle_a2a_task2(request: Request):
-    """Handles incoming A2A tasks for this worker agent."""
-    request_id = None
-    try:
-        payload = await request.json()
-        # print(f"\n[Worker Agent] Received A2A Request:\n{json.dumps(payload, indent=2)}") # Debug
-        request_id = payload.get("id")
-
-        # Basic JSON-RPC validation
-        if not all(k in payload for k in ["jsonrpc", "method", "params", "id"]):
-             return create_jsonrpc_error(-32600, "Invalid Request: Missing JSON-RPC fields.", request_id)
-        if payload["jsonrpc"] != "2.0":
-             return create_jsonrpc_error(-32600, "Invalid Request: Unsupported JSON-RPC version.", request_id)
-
-        method = payload.get("method")
-        params = payload.get("params", {})
-        task = params.get("task", {})
-        message = params.get("message", {})
-        parts = message.get("parts", [])
-        task_id = task.get("id", str(uuid.uuid4()))
-
-        if method == "tasks/send":
-            # Find the query text within the message parts
-            query_text = None
-            for part in parts:
-                if part.get("type") == "text":
-                    query_text = part.get("text")
-                    break # Use the first text part found
-
-
-            if query_text:
-                web_searcher_agent = Agent(
-                    model=Groq(id="meta-llama/llama-4-scout-17b-16e-instruct"),  # Using Groq Llama3-8b for speed
-                    # model=OpenAIChat(model="gpt-3.5-turbo"), # Or OpenAI
-                    description="You are a web search assistant. Use the DuckDuckGo tool to find information.",
-                    tools=[DuckDuckGoTools(fixed_max_results=3)],  # Use DuckDuckGo, limit results
-                    instructions=[
-                        "Understand the user query provided.",
-                        "Use the DuckDuckGo search tool to find relevant web pages.",
-                        "Summarize the key findings from the search results concisely.",
-                        "Return only the summarized findings as plain text.",
-                        "Do not include conversational filler like 'Okay, here are the results...'."
-                    ],
-                    show_tool_calls=True,  # Show tool calls for debugging
-                    debug_mode=True
-                )
-                print("[Worker Agent] Agno core initialized successfully.")
-                # Check if the agent core is initialized
-                if web_searcher_agent is None:
-                     print("[Worker Agent] ERROR: Agent core not initialized, cannot process task.")
-                     response_task = create_a2a_task_response(task_id, "failed", message_text="Agent core initialization failed.")
-                     return create_jsonrpc_response(response_task, request_id)
-
-                # Execute the core Agno logic
-                search_result_text = perform_search_task(query_text)
-
-                # Determine task status based on result
-                if search_result_text.startswith("Error:"):
-                     task_status = "failed"
-                     message_text = search_result_text
-                     artifacts = []
-                else:
-                     task_status = "completed"
-                     message_text = "Search task completed." # Optional status message
-                     # Package the result text into an A2A TextPart artifact
-                     artifacts = [{"type": "text", "text": search_result_text}]
-
-                response_task = create_a2a_task_response(task_id, task_status, artifacts=artifacts, message_text=message_text if task_status=="failed" else None)
-                return create_jsonrpc_response(response_task, request_id)
-            else:
-                # No suitable TextPart found for the query
-                print(f"[Worker Agent] ERROR: No 'text' part found in message for task {task_id}")
-                response_task = create_a2a_task_response(task_id, "failed", message_text="Required 'text' part missing in the input message.")
-                return create_jsonrpc_response(response_task, request_id)
-
-        else:
-            # Method not supported by this worker
-            print(f"[Worker Agent] ERROR: Method '{method}' not implemented.")
-            return create_jsonrpc_error(-32601, f"Method '{method}' not implemented by this agent.", request_id, status_code=501)
-
-    except json.JSONDecodeError:
-        print("[Worker Agent] ERROR: Invalid JSON payload.")
-        return create_jsonrpc_error(-32700, "Parse error: Invalid JSON.", request_id)
-    except Exception as e:
-        print(f"[Worker Agent] ERROR: Internal server error: {e}")
-        task_id_fallback = task.get("id", "unknown-task-id") if 'task' in locals() else "unknown-task-id"
-        response_task = create_a2a_task_response(task_id_fallback, "failed", message_text=f"Internal server error processing task: {e}")
-        request_id_fallback = request_id if request_id is not None else "unknown-req-id"
-        return JSONResponse(status_code=500, content={"jsonrpc": "2.0", "result": response_task, "id": request_id_fallback})
+# Legacy path kept for older callers; same handler, same shared agent
+app.add_api_route("/a2a/a2a", handle_a2a_task, methods=["POST"], summary="A2A JSON-RPC Endpoint for Worker (legacy path)")
 
 # --- Run Server ---
 if __name__ == "__main__":
     print(f"--- Starting Worker Agent Server ({MY_AGENT_CARD.name}) ---")
     print(f"Worker URL: {WORKER_URL}")
+    print(f"Server processes: {WORKER_PROCESSES}")
     print(f"Serving own Agent Card at: {WORKER_URL}/.well-known/agent.json")
     print(f"A2A Endpoint: {WORKER_URL}/a2a")
     print(f"Will attempt to register at Registry: {REGISTRY_URL}")
     print(f"----------------------------------------------")
-    # Use configured host and port
-    uvicorn.run(app, host=WORKER_HOST, port=WORKER_PORT)
+    serve(app, "worker_agent_server:app", WORKER_HOST, WORKER_PORT, WORKER_PROCESSES)
 
 # To run: python worker_agent_server.py
\ No newline at end of file